@@ -0,0 +1,60 @@
+import asyncio
+
+import aiohttp
+from telegram import Message
+from telegram.error import NetworkError, RetryAfter, TelegramError
+
+
+class AsyncBot:
+    # Асинхронный клиент Bot API на aiohttp для async_main.py — только методы,
+    # которые вызывает бот. Ошибки те же, что у telegram.Bot (RetryAfter на 429),
+    # поэтому Outbox обрабатывает их одинаково в обоих режимах
+    def __init__(self, token, base_url="https://api.telegram.org", connections=100, timeout=30.0):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.connections = connections
+        self.timeout = timeout
+        self._session = None
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def request(self, method, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        url = f"{self.base_url}/bot{self.token}/{method}"
+        try:
+            async with self._session.post(url, json=params) as response:
+                data = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise NetworkError(str(e)) from e
+        if not data.get("ok"):
+            retry_after = (data.get("parameters") or {}).get("retry_after")
+            if retry_after is not None:
+                raise RetryAfter(retry_after)
+            raise TelegramError(data.get("description", "Unknown error"))
+        return data["result"]
+
+    async def get_me(self):
+        return await self.request("getMe")
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        result = await self.request("sendMessage", chat_id=chat_id, text=text, parse_mode=parse_mode, **kwargs)
+        return Message.de_json(result, None)
+
+    async def edit_message_text(self, chat_id, message_id, text, parse_mode=None, **kwargs):
+        result = await self.request("editMessageText", chat_id=chat_id, message_id=message_id,
+                                    text=text, parse_mode=parse_mode, **kwargs)
+        return Message.de_json(result, None) if isinstance(result, dict) else result
+
+    async def delete_message(self, chat_id, message_id):
+        return await self.request("deleteMessage", chat_id=chat_id, message_id=message_id)
+
+    async def send_chat_action(self, chat_id, action):
+        return await self.request("sendChatAction", chat_id=chat_id, action=action)
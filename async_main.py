@@ -0,0 +1,536 @@
+import time
+import sys
+import asyncio
+import functools
+import logging
+from collections import deque
+from aiohttp import web
+from openai import AsyncOpenAI
+from async_bot import AsyncBot
+from story_loader import load_story
+from scheduler import AsyncScheduler
+from story_index import StoryIndex
+from state_store import UserStates, open_state_store
+from reply_cache import ReplyCache
+from reply_bank import open_reply_bank
+from outbox import AsyncOutbox, PRIORITY_REPLY, PRIORITY_STORY
+from dialogue import DialogueMemory, clip
+from metrics import Registry
+from gpt_gateway import AsyncModelGateway, CircuitBreaker, CircuitOpen, GatewayBusy
+from playback import next_block, next_line, pending_block
+from dedup import RecentKeys
+from traffic import TrafficRecorder
+from tracing import Tracer
+from profiler import ProfilerBusy, folded, sample
+from engine_common import Fallbacks, PendingInputs, check_admin, register_metrics, reply_context
+from config import (
+    ADMIN_TOKEN, ASYNC_SENDERS, CONTEXT_TOKEN_BUDGET, CONTINUE_DELAY, DELAY_SCALE, DIALOGUE_MAX_TURNS,
+    DIALOGUE_SUMMARY_BUDGET, DIALOGUE_TOKEN_BUDGET, GPT_STREAMING, INPUT_COALESCE_MAX_WAIT, INPUT_COALESCE_WINDOW,
+    INPUT_TOKEN_BUDGET, OPENAI_API_KEY, OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET, OPENAI_BUDGET,
+    OPENAI_MAX_CONCURRENCY, OPENAI_RETRIES, OPENAI_TIMEOUT, OPENAI_WAIT_TIMEOUT, OUTBOX_CHAT_RATE,
+    OUTBOX_GLOBAL_RATE, PLAYBACK_COALESCE, PLAYBACK_START_WINDOW, PLAYBACK_TYPING, PLAYBACK_TYPING_BEAT, PORT,
+    PROFILE_MAX_SECONDS, REPLY_BANK_PATH, REPLY_BANK_THRESHOLD, REPLY_CACHE_MAX_BYTES, REPLY_CACHE_SHORT_TOKENS,
+    REPLY_CACHE_TTL, REPLY_CACHE_VARIANTS, STATE_BACKEND, STATE_DB_PATH, STATE_FLUSH_INTERVAL, STATE_IDLE_TTL,
+    STATE_MAX_ACTIVE, STATE_SNAPSHOT_PATH, STORY_COMPILED_DIR, STORY_SOURCE, STREAM_EDIT_INTERVAL, TELEGRAM_API_URL,
+    TELEGRAM_BOT_TOKEN, TRACE_BUFFER_SIZE, TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_SALT, TRAFFIC_RECORD_TEXT,
+    UPDATE_DEDUP_MAX, UPDATE_DEDUP_WINDOW, UPDATE_QUEUE_SIZE,
+)
+
+# Асинхронный режим бота: тот же story и та же логика обработчиков, что в main.py,
+# но всё работает в одном цикле asyncio — вебхук на aiohttp, паузы проигрывания
+# на таймерах цикла, AsyncOpenAI и асинхронные запросы к Bot API. Ожидающий чат
+# стоит один таймер, а не поток, поэтому один процесс держит десятки тысяч чатов.
+#
+#   python async_main.py    # асинхронный режим
+#   python main.py          # многопоточный режим (через boot.py — по умолчанию, см. Procfile)
+#
+# Состояния игроков сбрасываются в хранилище тем же фоновым потоком UserStates,
+# а состояние чата, которого нет в памяти, загружается в пуле потоков до
+# обработки его апдейтов, поэтому ни запись, ни чтение SQLite не блокируют
+# цикл событий.
+
+logger = logging.getLogger(__name__)
+
+# Метрики в формате Prometheus, отдаются на /metrics
+registry = Registry()
+webhook_seconds = registry.histogram("horrorchat_webhook_seconds", "Время обработки запроса /webhook")
+handler_seconds = registry.histogram("horrorchat_handler_seconds", "Время работы обработчиков", ("handler",))
+openai_seconds = registry.histogram("horrorchat_openai_seconds", "Задержка запросов к OpenAI", ("mode", "result"))
+telegram_seconds = registry.histogram(
+    "horrorchat_telegram_seconds", "Задержка запросов к Telegram Bot API", ("method", "result")
+)
+# Спаны обработки апдейтов, отдаются на /debug/traces
+tracer = Tracer(TRACE_BUFFER_SIZE)
+
+# Повторы делает шлюз, поэтому у клиента свои отключены
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+gateway = AsyncModelGateway(
+    lambda **kwargs: client.chat.completions.create(**kwargs),
+    OPENAI_MAX_CONCURRENCY, OPENAI_WAIT_TIMEOUT, OPENAI_TIMEOUT, OPENAI_RETRIES,
+    budget=OPENAI_BUDGET, breaker=CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET),
+)
+bot = AsyncBot(TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, connections=ASYNC_SENDERS)
+scheduler = AsyncScheduler()
+story = load_story(STORY_COMPILED_DIR, STORY_SOURCE)
+story_index = StoryIndex(story, CONTEXT_TOKEN_BUDGET)
+dialogue = DialogueMemory(DIALOGUE_TOKEN_BUDGET, DIALOGUE_MAX_TURNS, DIALOGUE_SUMMARY_BUDGET)
+reply_cache = ReplyCache(REPLY_CACHE_MAX_BYTES, REPLY_CACHE_TTL, REPLY_CACHE_VARIANTS)
+reply_bank = open_reply_bank(REPLY_BANK_PATH, STORY_SOURCE, REPLY_BANK_THRESHOLD)
+outbox = AsyncOutbox(
+    bot, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, ASYNC_SENDERS,
+    observe=lambda method, seconds, ok: telegram_seconds.observe(seconds, method, "ok" if ok else "error"),
+    tracer=tracer,
+)
+
+def can_evict(user_id):
+    # Чат с запланированными событиями или неотвеченными репликами из памяти не выгружаем
+    if user_id in pending_inputs or user_id in chat_queues:
+        return False
+    return not any(scheduler.is_scheduled((user_id, kind)) for kind in ("playback", "continue", "input"))
+
+# Проигрывание, прерванное рестартом, не должно блокировать шаг навсегда
+user_states = UserStates(
+    open_state_store(STATE_BACKEND, STATE_DB_PATH), STATE_FLUSH_INTERVAL,
+    transient={"step_completed": True},
+    idle_ttl=STATE_IDLE_TTL, max_active=STATE_MAX_ACTIVE, can_evict=can_evict,
+)
+
+# Неотвеченные реплики игроков, которые копятся в окне склейки
+pending_inputs = PendingInputs(INPUT_COALESCE_WINDOW, INPUT_COALESCE_MAX_WAIT)
+fallbacks = Fallbacks(story_index)
+# Повторные доставки: увиденные update_id и недавние /start по чатам
+seen_updates = RecentKeys(UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_MAX)
+recent_starts = RecentKeys(PLAYBACK_START_WINDOW)
+duplicate_stats = {"continue": 0}
+# Запись трафика для replay.py — только если задан TRAFFIC_RECORD_PATH
+recorder = TrafficRecorder(TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_SALT, TRAFFIC_RECORD_TEXT) if TRAFFIC_RECORD_PATH else None
+
+def get_user_state(user_id):
+    return user_states.get(user_id)
+
+async def gpt_request(scene_name, step_index, user_input, state=None, **kwargs):
+    with tracer.span("context", scene=scene_name, step=step_index):
+        prompt = story_index.scene(scene_name).prompt(step_index)
+        messages = dialogue.request(prompt, state, user_input, INPUT_TOKEN_BUDGET)
+    mode = "stream" if kwargs.get("stream") else "full"
+    started = time.perf_counter()
+    try:
+        with tracer.span("openai", mode=mode):
+            response = await gateway.call(
+                model="gpt-3.5-turbo",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=100,
+                **kwargs
+            )
+    except (CircuitOpen, GatewayBusy):
+        raise
+    except Exception:
+        openai_seconds.observe(time.perf_counter() - started, mode, "error")
+        raise
+    openai_seconds.observe(time.perf_counter() - started, mode, "ok")
+    return response
+
+async def gpt_reply(scene_name, step_index, user_input, state=None):
+    cacheable, state = reply_context(dialogue, state, user_input, REPLY_CACHE_SHORT_TOKENS)
+    cached = reply_cache.get(scene_name, step_index, user_input) if cacheable else None
+    if cached is not None:
+        return cached
+
+    try:
+        response = await gpt_request(scene_name, step_index, user_input, state)
+        reply = response.choices[0].message.content.strip()
+    except Exception as e:
+        return fallbacks.reply(scene_name, step_index, user_input, e)
+
+    # Запасные реплики в кэш не попадают — только ответы модели
+    if cacheable:
+        reply_cache.put(scene_name, step_index, user_input, reply)
+    return reply
+
+async def gpt_reply_stream(scene_name, step_index, user_input, state=None):
+    # Отдаёт ответ модели кусками по мере генерации
+    stream = await gpt_request(scene_name, step_index, user_input, state, stream=True)
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Освобождаем слот шлюза, даже если стрим оборвали
+        await stream.aclose()
+
+def send_reply(chat_id, text):
+    # Ответы игроку уходят раньше строк сценария
+    return outbox.send(chat_id, PRIORITY_REPLY, text=text)
+
+def edit_reply(chat_id, message_id, text):
+    return outbox.send(chat_id, PRIORITY_REPLY, method="edit_message_text", message_id=message_id, text=text)
+
+def drop_placeholder(chat_id, future):
+    # Как в main.py: дошедшую после таймаута заглушку удаляем
+    if not future.cancelled() and future.exception() is None:
+        outbox.send(chat_id, PRIORITY_REPLY, method="delete_message", message_id=future.result().message_id)
+
+async def stream_reply(chat_id, scene_name, step_index, user_input, state=None, superseded=None):
+    # Как stream_reply в main.py: заглушка, правки не чаще STREAM_EDIT_INTERVAL,
+    # None — если игрок успел написать ещё и ответ больше не нужен
+    cacheable, state = reply_context(dialogue, state, user_input, REPLY_CACHE_SHORT_TOKENS)
+    cached = reply_cache.get(scene_name, step_index, user_input) if cacheable else None
+    if cached is not None:
+        send_reply(chat_id, cached)
+        return cached
+
+    # shield: по таймауту wait_for отменил бы future, а сообщение из очереди
+    # всё равно ушло бы — без результата его нечем было бы удалить
+    sent = send_reply(chat_id, "…")
+    try:
+        placeholder = await asyncio.wait_for(asyncio.shield(sent), 10)
+    except Exception:
+        sent.add_done_callback(functools.partial(drop_placeholder, chat_id))
+        reply = await gpt_reply(scene_name, step_index, user_input, state)
+        send_reply(chat_id, reply)
+        return reply
+
+    shown = "…"
+    text = ""
+    last_edit = time.monotonic()
+    chunks = gpt_reply_stream(scene_name, step_index, user_input, state)
+    try:
+        async for chunk in chunks:
+            if superseded is not None and superseded():
+                await chunks.aclose()
+                outbox.send(chat_id, PRIORITY_REPLY, method="delete_message", message_id=placeholder.message_id)
+                return None
+            text += chunk
+            if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL and text.strip():
+                shown = text.strip()
+                edit_reply(chat_id, placeholder.message_id, shown)
+                last_edit = time.monotonic()
+        text = text.strip()
+    except Exception:
+        logger.exception("Ошибка потокового ответа GPT")
+        text = ""
+
+    if text:
+        if cacheable:
+            reply_cache.put(scene_name, step_index, user_input, text)
+    else:
+        # Стрим не удался — обычный запрос без стриминга
+        text = await gpt_reply(scene_name, step_index, user_input, state)
+    if text != shown:
+        edit_reply(chat_id, placeholder.message_id, text)
+    return text
+
+def send_remaining_lines(user_id):
+    # Запускает проигрывание текущего шага, если оно ещё не идёт
+    state = get_user_state(user_id)
+    if state.paused or not state.step_completed:
+        return
+    state.step_completed = False  # Блокируем до завершения step
+    scheduler.schedule((user_id, "playback"), 0, play_next_line, user_id)
+
+async def play_next_line(user_id, typed=None):
+    # Одно событие проигрывания: очередная строка шага (в склеенном режиме —
+    # остаток шага) и таймер до следующего; typed — пауза, ушедшая на «печатает…»
+    state = get_user_state(user_id)
+    if state.paused:
+        return
+    steps = story[state.scene].steps
+    if PLAYBACK_COALESCE and PLAYBACK_TYPING and typed is None and pending_block(state, steps) is not None:
+        beat = min(PLAYBACK_TYPING_BEAT, steps[state.step].delay) * DELAY_SCALE
+        outbox.send(user_id, PRIORITY_STORY, method="send_chat_action", action="typing")
+        scheduler.schedule((user_id, "playback"), beat, play_next_line, user_id, beat)
+        return
+    line = next_block(state, steps) if PLAYBACK_COALESCE else next_line(state, steps)
+    if line is None:
+        return
+    text, parse_mode, delay = line
+    outbox.send(user_id, PRIORITY_STORY, text=text, parse_mode=parse_mode)
+    scheduler.schedule((user_id, "playback"), delay * DELAY_SCALE - (typed or 0.0), play_next_line, user_id)
+
+async def delayed_continue(user_id):
+    state = get_user_state(user_id)
+    if not state.paused:
+        send_remaining_lines(user_id)
+
+def cancel_events(user_id):
+    scheduler.cancel((user_id, "playback"))
+    scheduler.cancel((user_id, "continue"))
+
+async def start(user_id):
+    # Повторный /start сразу после первого (двойное нажатие) историю не перезапускает
+    if recent_starts.seen(user_id):
+        return
+    state = get_user_state(user_id)
+    cancel_events(user_id)
+    scheduler.cancel((user_id, "input"))
+    pending_inputs.discard(user_id)
+    state.reset()
+    send_remaining_lines(user_id)
+
+async def stop(user_id):
+    state = get_user_state(user_id)
+    state.paused = True
+    # Позиция внутри шага сохраняется, и /continue доиграет шаг с того же места
+    cancel_events(user_id)
+    state.step_completed = True
+    send_reply(user_id, "⏸️ История приостановлена. Напиши /continue, чтобы продолжить.")
+
+async def continue_command(user_id):
+    state = get_user_state(user_id)
+    # Шаг уже проигрывается — повторный /continue ничего не делает
+    if not state.paused and not state.step_completed:
+        duplicate_stats["continue"] += 1
+        return
+    state.paused = False
+    send_reply(user_id, "▶️ Продолжаем...")
+    send_remaining_lines(user_id)
+
+async def answer_player(user_id, user_input, superseded=None):
+    # Ответ GPT на реплику игрока. Возвращает False, если отвечать не нужно:
+    # история закончилась или игрок уже написал что-то новое
+    state = get_user_state(user_id)
+    scene_name = state.scene
+    step_index = state.step
+
+    if step_index >= story_index.scene(scene_name).size:
+        return False
+
+    if GPT_STREAMING:
+        reply = await stream_reply(user_id, scene_name, step_index, user_input, state, superseded)
+        if reply is None:
+            return False
+    else:
+        reply = await gpt_reply(scene_name, step_index, user_input, state)
+        if superseded is not None and superseded():
+            return False
+        send_reply(user_id, reply)
+
+    remember_reply(user_id, state, user_input, reply)
+    return True
+
+def answer_from_bank(user_id, user_input):
+    # Частая реплика, для которой на этом шаге есть готовый ответ, — без модели
+    state = get_user_state(user_id)
+    if state.step >= story_index.scene(state.scene).size:
+        return False
+    reply = reply_bank.get(state.scene, state.step, user_input)
+    if reply is None:
+        return False
+    send_reply(user_id, reply)
+    remember_reply(user_id, state, user_input, reply)
+    return True
+
+def remember_reply(user_id, state, user_input, reply):
+    # Запоминаем реплики для следующих запросов
+    dialogue.add(state, "user", clip(user_input, INPUT_TOKEN_BUDGET))
+    dialogue.add(state, "assistant", reply)
+    scheduler.schedule((user_id, "continue"), CONTINUE_DELAY, delayed_continue, user_id)
+
+async def flush_input(user_id):
+    # Все реплики, накопленные за окно, уходят в модель одним запросом
+    # (подробности — flush_input в main.py)
+    batch = pending_inputs.take(user_id)
+    if batch is None:
+        return
+    delivered = await answer_player(user_id, "\n".join(batch.texts), batch.superseded)
+    pending_inputs.done(user_id, batch, delivered)
+
+async def handle_message(user_id, user_input):
+    user_input = user_input.strip()
+
+    # Отменяем отложенное продолжение, если оно уже запланировано
+    scheduler.cancel((user_id, "continue"))
+
+    # Готовый ответ уходит сразу, не дожидаясь окна склейки
+    if reply_bank is not None and user_id not in pending_inputs and answer_from_bank(user_id, user_input):
+        return
+
+    if INPUT_COALESCE_WINDOW <= 0:
+        await answer_player(user_id, user_input)
+        return
+
+    # Копим реплики: каждое новое сообщение сдвигает окно, но не дальше
+    # INPUT_COALESCE_MAX_WAIT от первого сообщения пачки
+    delay = pending_inputs.add(user_id, user_input, time.monotonic())
+    scheduler.schedule((user_id, "input"), delay, flush_input, user_id)
+
+COMMANDS = {"start": start, "stop": stop, "continue": continue_command}
+
+def parse_update(data):
+    # (chat_id, команда или None, текст) для текстового сообщения, иначе None.
+    # Команда — как у CommandHandler: сущность bot_command в начале сообщения
+    message = data.get("message")
+    if not isinstance(message, dict) or not isinstance(message.get("text"), str):
+        return None
+    chat_id = message.get("chat", {}).get("id")
+    if chat_id is None:
+        return None
+    text = message["text"]
+    entities = message.get("entities") or []
+    if entities and entities[0].get("type") == "bot_command" and entities[0].get("offset") == 0:
+        command = text[1:entities[0]["length"]].split("@")[0].lower()
+        return chat_id, command, text
+    return chat_id, None, text
+
+async def process_update(data):
+    parsed = parse_update(data)
+    if parsed is None:
+        return
+    chat_id, command, text = parsed
+    # Таймеры и задачи, созданные при обработке, наследуют контекст апдейта
+    with tracer.bind(data.get("update_id"), chat_id), tracer.span("dispatch"):
+        if command is not None:
+            handler = COMMANDS.get(command)
+            if handler is not None:
+                with handler_seconds.time(handler.__name__):
+                    await handler(chat_id)
+            return
+        with handler_seconds.time("handle_message"):
+            await handle_message(chat_id, text)
+
+# Апдейты одного чата обрабатываются строго по очереди, разные чаты — параллельно
+chat_queues = {}
+update_stats = {"pending": 0, "rejected": 0}
+_chat_tasks = set()
+
+def enqueue_update(data):
+    # False — слишком много необработанных апдейтов. Повторная доставка
+    # уже принятого апдейта сразу подтверждается и не обрабатывается
+    if update_stats["pending"] >= UPDATE_QUEUE_SIZE:
+        update_stats["rejected"] += 1
+        return False
+    if seen_updates.seen(data.get("update_id")):
+        return True
+    parsed = parse_update(data)
+    chat_id = parsed[0] if parsed else None
+    updates = chat_queues.get(chat_id)
+    if updates is None:
+        updates = chat_queues[chat_id] = deque()
+        task = asyncio.get_running_loop().create_task(drain_chat(chat_id, updates))
+        _chat_tasks.add(task)
+        task.add_done_callback(_chat_tasks.discard)
+    updates.append(data)
+    update_stats["pending"] += 1
+    return True
+
+async def load_state(chat_id):
+    # Чтение из хранилища ждёт его лок, который фоновая запись держит всю
+    # транзакцию, — поэтому не в цикле событий. Пока у чата есть апдейты
+    # в chat_queues, он не выгружается, и обработчики берут состояние из памяти
+    if chat_id is not None and chat_id not in user_states:
+        await asyncio.get_running_loop().run_in_executor(None, user_states.get, chat_id)
+
+async def drain_chat(chat_id, updates):
+    try:
+        while updates:
+            data = updates[0]
+            try:
+                await load_state(chat_id)
+                await process_update(data)
+            except Exception:
+                logger.exception("Ошибка при обработке апдейта")
+            finally:
+                updates.popleft()
+                update_stats["pending"] -= 1
+    finally:
+        chat_queues.pop(chat_id, None)
+
+async def webhook(request):
+    with webhook_seconds.time():
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or "update_id" not in data:
+            return web.Response(status=400, text="bad request")
+        if recorder is not None:
+            recorder.record(data)
+
+        # Очередь переполнена — отвечаем 429, Telegram повторит доставку позже
+        with tracer.span("webhook", update_id=data["update_id"]):
+            accepted = enqueue_update(data)
+        if not accepted:
+            return web.Response(status=429, text="busy", headers={"Retry-After": "1"})
+        return web.Response(text="ok")
+
+async def metrics(request):
+    return web.Response(body=registry.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+def admin_denied(request):
+    denied = check_admin(request.headers.get("X-Admin-Token"), ADMIN_TOKEN)
+    if denied is None:
+        return None
+    status, text = denied
+    return web.Response(status=status, text=text)
+
+def query_number(request, name, default, type=int):
+    try:
+        return type(request.query[name])
+    except (KeyError, ValueError):
+        return default
+
+async def debug_traces(request):
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    spans = tracer.export(
+        query_number(request, "update_id", None), query_number(request, "chat_id", None),
+        query_number(request, "limit", 1000),
+    )
+    return web.json_response({"recorded": tracer.recorded, "spans": spans})
+
+async def debug_profile(request):
+    # Стеки снимаются в отдельном потоке, цикл событий в это время работает как обычно
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    seconds = min(query_number(request, "seconds", 10.0, float), PROFILE_MAX_SECONDS)
+    interval = max(query_number(request, "interval", 0.01, float), 0.001)
+    try:
+        stacks = await asyncio.get_running_loop().run_in_executor(None, sample, seconds, interval)
+    except ProfilerBusy:
+        return web.Response(status=409, text="profile already running")
+    return web.Response(text=folded(stacks))
+
+register_metrics(registry, sys.modules[__name__])
+registry.gauge("horrorchat_update_queue", "Апдейты в очереди на обработку", lambda: update_stats["pending"])
+registry.counter("horrorchat_updates_rejected_total", "Апдейты, отклонённые из-за переполнения",
+                 lambda: update_stats["rejected"])
+
+async def on_startup(app):
+    # Горячие чаты из снимка прошлой остановки — в память, их эпизоды — в индекс
+    if STATE_SNAPSHOT_PATH:
+        for scene in {state.scene for state in user_states.restore(STATE_SNAPSHOT_PATH)}:
+            if scene in story:
+                story_index.scene(scene)
+    await bot.start()
+    scheduler.start()
+    outbox.start()
+    user_states.start()
+    if recorder is not None:
+        recorder.start()
+
+async def on_cleanup(app):
+    # Несброшенные состояния сохраняем при остановке, горячие чаты — в снимок
+    user_states.flush()
+    if STATE_SNAPSHOT_PATH:
+        user_states.snapshot(STATE_SNAPSHOT_PATH)
+    if recorder is not None:
+        recorder.flush()
+    await bot.close()
+
+def create_app():
+    app = web.Application()
+    app.router.add_post("/webhook", webhook)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/debug/traces", debug_traces)
+    app.router.add_get("/debug/profile", debug_profile)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == "__main__":
+    # run_app сам обрабатывает SIGTERM/SIGINT и вызывает on_cleanup
+    web.run_app(create_app(), host="0.0.0.0", port=PORT)
@@ -0,0 +1,210 @@
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from config import BOOT_BUFFER_SIZE, PORT, STORY_COMPILED_DIR, STORY_SOURCE
+
+# Быстрый старт для дино, которые засыпают без трафика:
+#
+#   python boot.py
+#
+# Порт открывается сразу, на одних модулях стандартной библиотеки. Пока
+# в фоне импортируются Flask, telegram и сам main.py, вебхуки принимаются
+# в буфер и сразу подтверждаются (200), остальные запросы получают 503.
+# Когда бот загружен, буфер по порядку уходит в main.enqueue_update, а все
+# запросы — в main.app. Затем снимок горячих чатов загружается в память,
+# а клиент OpenAI создаётся заранее, уже не задерживая приём апдейтов.
+#
+# Время этапов старта пишется в лог и отдаётся в /metrics:
+# horrorchat_startup_phase_seconds{phase} — длительность этапов,
+# horrorchat_startup_event_seconds{event} — события от запуска процесса
+# (порт открыт, первый вебхук, бот готов, первое сообщение игроку).
+
+STARTED = time.perf_counter()
+logger = logging.getLogger(__name__)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class Boot:
+    def __init__(self, buffer_size=1000):
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.app = None
+        self.phases = {}
+        self.events = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def mark(self, event):
+        self.events.setdefault(event, time.perf_counter() - STARTED)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def __call__(self, environ, start_response):
+        # WSGI-приложение: до загрузки бота — буфер вебхуков, после — main.app
+        app = self.app
+        if app is None and environ["PATH_INFO"] == "/webhook" and environ["REQUEST_METHOD"] == "POST":
+            return self.accept(environ, start_response)
+        if app is None:
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain"), ("Retry-After", "1")])
+            return [b"starting"]
+        return app(environ, start_response)
+
+    def accept(self, environ, start_response):
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            data = json.loads(environ["wsgi.input"].read(length))
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or "update_id" not in data:
+            start_response("400 Bad Request", [("Content-Type", "text/plain")])
+            return [b"bad request"]
+        self.mark("first_webhook")
+        with self._lock:
+            if self.app is not None:
+                # Бот загрузился, пока читали тело запроса
+                return self.app.webhook_direct(data, start_response)
+            if len(self.buffer) >= self.buffer_size:
+                start_response("429 Too Many Requests", [("Content-Type", "text/plain"), ("Retry-After", "1")])
+                return [b"busy"]
+            self.buffer.append(data)
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"ok"]
+
+    def load(self):
+        with self.phase("flask"):
+            import flask  # noqa: F401
+        with self.phase("telegram"):
+            import telegram.ext  # noqa: F401
+        with self.phase("story"):
+            # Перекомпиляция, если story.py изменился; main.py затем только читает каталог
+            from story_loader import load_story
+
+            load_story(STORY_COMPILED_DIR, STORY_SOURCE)
+        with self.phase("main"):
+            import main
+        self.register_metrics(main)
+        self.watch_first_reply(main)
+
+        with self.phase("handoff"):
+            self.hand_off(main)
+        self.mark("ready")
+
+        with self.phase("state_snapshot"):
+            restored = main.restore_hot_state()
+        with self.phase("openai"):
+            main.init_openai()
+        self.mark("warm")
+        logger.info(
+            "Старт: %s; чатов из снимка: %s; события: %s",
+            ", ".join(f"{name} {seconds:.3f} с" for name, seconds in self.phases.items()), restored,
+            ", ".join(f"{name} {seconds:.3f} с" for name, seconds in self.events.items()),
+        )
+
+    def hand_off(self, main):
+        # Буфер уходит в пул по порядку и под локом: новый вебхук того же чата
+        # не должен обогнать апдейты, принятые до загрузки
+        app = WebhookApp(main)
+        with self._lock:
+            for data in self.buffer:
+                if main.recorder is not None:
+                    main.recorder.record(data)
+                deadline = time.monotonic() + 5
+                while not main.enqueue_update(data):
+                    if time.monotonic() > deadline:
+                        self.dropped += 1
+                        logger.warning("Апдейт %s из буфера старта отброшен: очередь переполнена", data["update_id"])
+                        break
+                    time.sleep(0.05)
+            self.buffer = []
+            self.app = app
+
+    def watch_first_reply(self, main):
+        observe = main.outbox.observe
+
+        def first_reply(method, seconds, ok):
+            if ok:
+                self.mark("first_reply")
+            observe(method, seconds, ok)
+
+        main.outbox.observe = first_reply
+
+    def register_metrics(self, main):
+        main.registry.gauge(
+            "horrorchat_startup_phase_seconds", "Длительность этапов старта процесса",
+            lambda: {(name,): round(seconds, 6) for name, seconds in self.phases.items()}, ("phase",),
+        )
+        main.registry.gauge(
+            "horrorchat_startup_event_seconds", "События старта: секунды от запуска процесса",
+            lambda: {(name,): round(seconds, 6) for name, seconds in self.events.items()}, ("event",),
+        )
+        main.registry.counter("horrorchat_startup_dropped_total", "Апдейты из буфера старта, не попавшие в очередь",
+                              lambda: self.dropped)
+
+
+class WebhookApp:
+    # main.app и приём вебхука в обход Flask для запроса, тело которого
+    # уже прочитано буфером старта
+    def __init__(self, main):
+        self.main = main
+
+    def __call__(self, environ, start_response):
+        return self.main.app(environ, start_response)
+
+    def webhook_direct(self, data, start_response):
+        main = self.main
+        if main.recorder is not None:
+            main.recorder.record(data)
+        if not main.enqueue_update(data):
+            start_response("429 Too Many Requests", [("Content-Type", "text/plain"), ("Retry-After", "1")])
+            return [b"busy"]
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"ok"]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    boot = Boot(BOOT_BUFFER_SIZE)
+    server = make_server("0.0.0.0", PORT, boot, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    boot.mark("listen")
+
+    def load():
+        try:
+            boot.load()
+        except Exception:
+            logger.exception("Бот не загрузился")
+            server.shutdown()
+
+    threading.Thread(target=load, name="boot", daemon=True).start()
+    # При остановке дино main.py сохраняет состояния через atexit
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    if boot.app is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import itertools
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+# Локальная заглушка Bot API для стендов без сети и для тестов polling.py:
+#
+#   python bot_api_stub.py --port 8081
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 python polling.py
+#
+# Апдейты для getUpdates добавляются через POST /stub/updates (один апдейт
+# или список), отправленные ботом сообщения видны в GET /stub/sent.
+# getUpdates ведёт себя как у Telegram: запрос с offset подтверждает все
+# апдейты ниже него, а пустой ответ ждёт новых апдейтов до timeout секунд.
+
+
+class BotApiStub:
+    def __init__(self, username="stub_bot"):
+        self.username = username
+        self.updates = []
+        self.sent = []
+        self.calls = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def add_update(self, data):
+        with self._cond:
+            data.setdefault("update_id", next(self._update_ids))
+            self.updates.append(data)
+            self._cond.notify_all()
+        return data["update_id"]
+
+    def call(self, method, params):
+        self.calls.append((method, dict(params)))
+        if method == "getUpdates":
+            return self.get_updates(
+                int(params.get("offset", 0)), int(params.get("limit", 100)), float(params.get("timeout", 0))
+            )
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Stub", "username": self.username}
+        if method in ("sendMessage", "editMessageText"):
+            self.sent.append(dict(params))
+            return {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    def get_updates(self, offset=0, limit=100, timeout=0.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.updates = [data for data in self.updates if data["update_id"] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self.updates[:limit]
+
+
+class StubRequest:
+    # Вместо telegram.utils.request.Request: Bot(..., request=StubRequest(stub))
+    # обращается к заглушке в том же процессе, без HTTP
+    def __init__(self, stub):
+        self.stub = stub
+
+    def post(self, url, data=None, timeout=None):
+        return self.stub.call(url.rsplit("/", 1)[-1], data or {})
+
+    def stop(self):
+        pass
+
+
+def create_app(stub):
+    app = Flask(__name__)
+
+    @app.route("/bot<token>/<method>", methods=["GET", "POST"])
+    def api(token, method):
+        params = request.get_json(silent=True) or request.values.to_dict()
+        return jsonify(ok=True, result=stub.call(method, params))
+
+    @app.route("/stub/updates", methods=["POST"])
+    def add_updates():
+        data = request.get_json()
+        ids = [stub.add_update(update) for update in (data if isinstance(data, list) else [data])]
+        return jsonify(ok=True, result=ids)
+
+    @app.route("/stub/sent")
+    def sent():
+        return jsonify(ok=True, result=stub.sent)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    create_app(BotApiStub()).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
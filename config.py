@@ -0,0 +1,107 @@
+import os
+
+from dotenv import load_dotenv
+
+# Настройки бота из переменных окружения (и файла .env).
+# Общие для многопоточного (main.py) и асинхронного (async_main.py) режимов
+
+# Загрузка переменных окружения
+load_dotenv()
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Адрес Bot API (для локального сервера Bot API или заглушки на стенде)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+# Пул обработки апдейтов: вебхук только кладёт апдейт в очередь и сразу отвечает
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Повторные доставки апдейтов: окно и размер множества увиденных update_id,
+# а также окно, в котором повторный /start не перезапускает историю
+UPDATE_DEDUP_WINDOW = float(os.getenv("UPDATE_DEDUP_WINDOW", "3600"))
+UPDATE_DEDUP_MAX = int(os.getenv("UPDATE_DEDUP_MAX", "100000"))
+PLAYBACK_START_WINDOW = float(os.getenv("PLAYBACK_START_WINDOW", "3"))
+# Запись входящего трафика для replay.py (пустой путь — не записывать).
+# Без соли она генерируется на каждый запуск процесса
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH", "")
+TRAFFIC_RECORD_SALT = os.getenv("TRAFFIC_RECORD_SALT", "") or os.urandom(16).hex()
+TRAFFIC_RECORD_TEXT = os.getenv("TRAFFIC_RECORD_TEXT", "0") == "1"
+# Трассировка: сколько последних спанов держать в памяти (0 — выключена).
+# /debug/traces и /debug/profile доступны только с заголовком X-Admin-Token;
+# без ADMIN_TOKEN они выключены
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+# Пул, в котором выполняются события проигрывания и отложенные продолжения
+PLAYBACK_WORKERS = int(os.getenv("PLAYBACK_WORKERS", "4"))
+CONTINUE_DELAY = float(os.getenv("CONTINUE_DELAY", "10"))
+# Склеенное проигрывание: остаток шага уходит одним сообщением вместо
+# сообщения на строку; с PLAYBACK_TYPING перед ним до PLAYBACK_TYPING_BEAT
+# секунд паузы (в секундах story.py) показывается «печатает…»
+PLAYBACK_COALESCE = os.getenv("PLAYBACK_COALESCE", "0") == "1"
+PLAYBACK_TYPING = os.getenv("PLAYBACK_TYPING", "0") == "1"
+PLAYBACK_TYPING_BEAT = float(os.getenv("PLAYBACK_TYPING_BEAT", "3"))
+# Множитель пауз из story.py (для стендов и нагрузочных тестов)
+DELAY_SCALE = float(os.getenv("DELAY_SCALE", "1"))
+# Хранилище состояний игроков: memory (для тестов) или sqlite (файл в режиме WAL)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "user_states.db")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2"))
+# Простаивающие чаты выгружаются из памяти и восстанавливаются при следующем сообщении
+STATE_IDLE_TTL = float(os.getenv("STATE_IDLE_TTL", "1800"))
+STATE_MAX_ACTIVE = int(os.getenv("STATE_MAX_ACTIVE", "10000"))
+# Снимок чатов из памяти при остановке; при старте загружается вместо
+# чтения хранилища (пустой путь — не сохранять)
+STATE_SNAPSHOT_PATH = os.getenv("STATE_SNAPSHOT_PATH", "user_states.db.snapshot")
+# Быстрый старт (boot.py): сколько вебхуков держать, пока загружается бот
+BOOT_BUFFER_SIZE = int(os.getenv("BOOT_BUFFER_SIZE", "1000"))
+# Кэш ответов GPT на одинаковые реплики на одном шаге. Реплики не длиннее
+# REPLY_CACHE_SHORT_TOKENS токенов отвечаются без памяти диалога и всегда идут
+# через кэш; длинные — только пока у игрока нет памяти, с ней промпт у каждого свой
+REPLY_CACHE_MAX_BYTES = int(os.getenv("REPLY_CACHE_MAX_BYTES", "4000000"))
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "3600"))
+REPLY_CACHE_VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS", "1"))
+REPLY_CACHE_SHORT_TOKENS = int(os.getenv("REPLY_CACHE_SHORT_TOKENS", "6"))
+# Банк готовых ответов на частые реплики (собирается reply_bank.py)
+REPLY_BANK_PATH = os.getenv("REPLY_BANK_PATH", "reply_bank.json")
+REPLY_BANK_THRESHOLD = float(os.getenv("REPLY_BANK_THRESHOLD", "0.75"))
+# Потоковые ответы: заглушка и её правки по мере генерации
+GPT_STREAMING = os.getenv("GPT_STREAMING", "0") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Шлюз к OpenAI: одновременные запросы, ожидание слота, таймаут попытки,
+# повторы временных ошибок и размыкатель цепи после серии ошибок подряд
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_WAIT_TIMEOUT = float(os.getenv("OPENAI_WAIT_TIMEOUT", "2"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "15"))
+OPENAI_RETRIES = int(os.getenv("OPENAI_RETRIES", "2"))
+OPENAI_BUDGET = float(os.getenv("OPENAI_BUDGET", "30"))
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_RESET = float(os.getenv("OPENAI_BREAKER_RESET", "30"))
+# Окно склейки реплик: сообщения, пришедшие подряд, уходят в модель одним запросом.
+# 0 — отвечать на каждое сообщение сразу
+INPUT_COALESCE_WINDOW = float(os.getenv("INPUT_COALESCE_WINDOW", "1.5"))
+INPUT_COALESCE_MAX_WAIT = float(os.getenv("INPUT_COALESCE_MAX_WAIT", "4"))
+# Исходящие сообщения: лимиты Telegram (общий и на чат) и пул отправителей
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "4"))
+# Режим long polling (polling.py): размер пачки getUpdates, наибольшее ожидание
+# на сервере, файл с offset и необработанными апдейтами и порт для /metrics
+# (0 — не поднимать HTTP-сервер)
+POLLING_BATCH = int(os.getenv("POLLING_BATCH", "100"))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "25"))
+POLLING_OFFSET_PATH = os.getenv("POLLING_OFFSET_PATH", "polling_offset.json")
+POLLING_METRICS_PORT = int(os.getenv("POLLING_METRICS_PORT", "0"))
+# Многопроцессный режим (sharding.py): число процессов-воркеров и очередь каждого
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 2)))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+# Асинхронный режим (async_main.py): одновременные запросы к Bot API и порт сервера
+ASYNC_SENDERS = int(os.getenv("ASYNC_SENDERS", "64"))
+PORT = int(os.getenv("PORT", "10000"))
+# Лимиты промпта в токенах: контекст сцены, память диалога, её выжимка и ввод игрока
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+DIALOGUE_TOKEN_BUDGET = int(os.getenv("DIALOGUE_TOKEN_BUDGET", "300"))
+DIALOGUE_MAX_TURNS = int(os.getenv("DIALOGUE_MAX_TURNS", "12"))
+DIALOGUE_SUMMARY_BUDGET = int(os.getenv("DIALOGUE_SUMMARY_BUDGET", "100"))
+INPUT_TOKEN_BUDGET = int(os.getenv("INPUT_TOKEN_BUDGET", "150"))
+# Скомпилированная история; перекомпилируется сама, если story.py изменился
+STORY_COMPILED_DIR = os.getenv("STORY_COMPILED_DIR", "compiled_story")
+STORY_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "story.py")
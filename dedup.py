@@ -0,0 +1,38 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecentKeys:
+    # Ключи, виденные за последние window секунд, но не больше max_size штук.
+    # Ключи лежат в порядке добавления, поэтому устаревшие снимаются с начала
+    # за O(1) на ключ, а память ограничена даже при всплеске апдейтов
+    def __init__(self, window=600.0, max_size=100_000):
+        self.window = window
+        self.max_size = max_size
+        self.duplicates = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def seen(self, key):
+        # True — ключ уже был в окне (повтор); иначе запоминает его
+        now = time.monotonic()
+        with self._lock:
+            while self._keys:
+                oldest, added = next(iter(self._keys.items()))
+                if now - added < self.window and len(self._keys) < self.max_size:
+                    break
+                del self._keys[oldest]
+            if key in self._keys:
+                self.duplicates += 1
+                return True
+            self._keys[key] = now
+            return False
+
+    def forget(self, key):
+        # Апдейт не был принят (например, очередь переполнена) — повтор нужно обработать
+        with self._lock:
+            self._keys.pop(key, None)
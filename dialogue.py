@@ -0,0 +1,94 @@
+import math
+import re
+
+_TOKENS = re.compile(r"[^\W\d_]+|\d+|[^\w\s]", re.UNICODE)
+_CYRILLIC = re.compile(r"[а-яё]", re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    # Грубая локальная оценка числа токенов без обращения к сети:
+    # кириллица в среднем ~3 символа на токен, латиница ~4, знак препинания — токен
+    tokens = 0
+    for part in _TOKENS.findall(text):
+        if part.isalpha():
+            tokens += math.ceil(len(part) / (3 if _CYRILLIC.search(part) else 4))
+        elif part.isdigit():
+            tokens += math.ceil(len(part) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+def clip(text, max_tokens):
+    # Обрезает текст так, чтобы он укладывался в max_tokens
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    result = []
+    used = 0
+    for word in words:
+        used += estimate_tokens(word)
+        if used > max_tokens:
+            break
+        result.append(word)
+    return " ".join(result) + "…"
+
+
+class DialogueMemory:
+    # Память диалога игрока: кольцевой буфер последних реплик в state.history
+    # с жёстким лимитом токенов. Реплики, которые не помещаются, сворачиваются
+    # в короткую выжимку state.summary, у которой тоже есть свой лимит.
+    def __init__(self, token_budget=300, max_turns=12, summary_budget=100):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_budget = summary_budget
+
+    def add(self, state, role, text):
+        history = list(state.history)
+        history.append([role, text])
+        summary = state.summary
+        total = sum(estimate_tokens(t) for _, t in history)
+        while history and (len(history) > self.max_turns or total > self.token_budget):
+            old_role, old_text = history.pop(0)
+            total -= estimate_tokens(old_text)
+            summary = self._fold(summary, old_role, old_text)
+        state.history = history
+        state.summary = summary
+
+    def _fold(self, summary, role, text):
+        # Из старой реплики остаётся только начало
+        line = clip(text, 12)
+        if role == "user":
+            line = f"Алекс: {line}"
+        lines = summary.split("\n") if summary else []
+        lines.append(line)
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_budget:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def summary_block(self, state):
+        summary = state.summary
+        if not summary:
+            return ""
+        return f"\nРанее в разговоре с Алекс:\n{summary}\n"
+
+    def messages(self, state):
+        return [{"role": role, "content": text} for role, text in state.history]
+
+    def remembers(self, state):
+        # Есть ли у игрока своя память диалога: тогда промпт у него свой,
+        # и ответ нельзя ни брать из общего кэша, ни класть в него
+        return state is not None and bool(state.history or state.summary)
+
+    def request(self, prompt, state, user_input, input_budget):
+        # Сообщения для модели: системный промпт с выжимкой, последние реплики
+        # и обрезанный по лимиту ввод игрока
+        history = []
+        if state is not None:
+            prompt += self.summary_block(state)
+            history = self.messages(state)
+        return [
+            {"role": "system", "content": prompt},
+            *history,
+            {"role": "user", "content": clip(user_input, input_budget)},
+        ]
@@ -0,0 +1,173 @@
+import hmac
+import logging
+import threading
+import zlib
+
+from dialogue import estimate_tokens
+from gpt_gateway import CircuitOpen, GatewayBusy
+from reply_cache import normalize
+
+# Общие части многопоточного (main.py) и асинхронного (async_main.py) режимов,
+# которые не зависят от того, как устроен цикл обработки
+
+logger = logging.getLogger(__name__)
+
+
+class Fallbacks:
+    # Модель недоступна — отвечает персонаж сцены заготовленной репликой.
+    # stats — сколько таких ответов и почему: цепь разомкнута, нет слота, ошибка
+    def __init__(self, story_index):
+        self.story_index = story_index
+        self.stats = {"open": 0, "busy": 0, "error": 0}
+
+    def reply(self, scene_name, step_index, user_input, error):
+        if isinstance(error, CircuitOpen):
+            self.stats["open"] += 1
+        elif isinstance(error, GatewayBusy):
+            self.stats["busy"] += 1
+        else:
+            self.stats["error"] += 1
+            logger.warning("Ошибка GPT: %s", error)
+        seed = zlib.crc32(user_input.encode("utf-8"))
+        return self.story_index.scene(scene_name).fallback(step_index, seed)
+
+
+class InputBatch:
+    # Реплики, отправленные в модель одним запросом
+    __slots__ = ("pending", "texts", "generation")
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.texts = list(pending["texts"])
+        self.generation = pending["generation"]
+
+    def superseded(self):
+        # Игрок успел написать ещё — ответ на эту пачку уже не нужен
+        return self.pending["generation"] != self.generation
+
+
+class PendingInputs:
+    # Неотвеченные реплики игроков, которые копятся в окне склейки: каждое
+    # новое сообщение сдвигает окно на window секунд, но не дальше max_wait
+    # от первого сообщения пачки. Реплики удаляются из буфера только после
+    # доставки ответа: если за время запроса пришло новое сообщение, этот ответ
+    # отбрасывается, а следующий запрос ответит на всё сразу.
+    # Синхронизацию обеспечивает вызывающий: лок чата в main.py, цикл событий
+    # в async_main.py
+    def __init__(self, window, max_wait):
+        self.window = window
+        self.max_wait = max_wait
+        self.stats = {"merged": 0, "superseded": 0}
+        self._pending = {}
+
+    def __contains__(self, user_id):
+        return user_id in self._pending
+
+    def __len__(self):
+        return len(self._pending)
+
+    def discard(self, user_id):
+        self._pending.pop(user_id, None)
+
+    def add(self, user_id, text, now):
+        # Возвращает, через сколько секунд отвечать на накопленное
+        pending = self._pending.setdefault(user_id, {"texts": [], "generation": 0, "first_at": now})
+        if not pending["texts"]:
+            pending["first_at"] = now
+        pending["texts"].append(text)
+        pending["generation"] += 1
+        return min(self.window, pending["first_at"] + self.max_wait - now)
+
+    def take(self, user_id):
+        pending = self._pending.get(user_id)
+        if not pending or not pending["texts"]:
+            return None
+        return InputBatch(pending)
+
+    def done(self, user_id, batch, delivered):
+        if delivered:
+            self.stats["merged"] += len(batch.texts) - 1
+            del batch.pending["texts"][:len(batch.texts)]
+            if not batch.pending["texts"]:
+                self._pending.pop(user_id, None)
+        elif batch.superseded():
+            self.stats["superseded"] += 1
+        else:
+            self._pending.pop(user_id, None)
+
+
+def reply_context(dialogue, state, user_input, short_tokens):
+    # Короткие реплики («ок», «кто там?») модель получает без памяти диалога:
+    # промпт тогда один для всех игроков на шаге, и ответ идёт через общий кэш.
+    # На длинные отвечает с памятью игрока, если она есть, и мимо кэша.
+    # Возвращает (через кэш ли ответ, состояние для промпта)
+    if estimate_tokens(normalize(user_input)) <= short_tokens:
+        return True, None
+    return not dialogue.remembers(state), state
+
+
+def check_admin(token, admin_token):
+    # Отладочные ручки: без ADMIN_TOKEN их нет, без верного токена — 403.
+    # None — доступ есть, иначе (статус, текст ответа)
+    if not admin_token:
+        return 404, "not found"
+    if not hmac.compare_digest(token or "", admin_token):
+        return 403, "forbidden"
+    return None
+
+
+def register_metrics(registry, engine):
+    # Метрики, общие для обоих режимов; engine — модуль main или async_main.
+    # Объекты берутся из модуля при каждом снятии метрик
+    registry.gauge("horrorchat_active_chats", "Чаты с состоянием в памяти", lambda: len(engine.user_states))
+    registry.counter("horrorchat_evicted_chats_total", "Чаты, выгруженные из памяти по простою",
+                     lambda: engine.user_states.evicted)
+    registry.gauge("horrorchat_threads", "Живые потоки процесса", threading.active_count)
+    registry.gauge("horrorchat_pending_timers", "Запланированные события проигрывания",
+                   lambda: engine.scheduler.pending())
+    registry.counter(
+        "horrorchat_duplicates_total", "Повторы: доставки апдейтов, /start и /continue во время проигрывания",
+        lambda: {("update",): engine.seen_updates.duplicates, ("start",): engine.recent_starts.duplicates,
+                 ("continue",): engine.duplicate_stats["continue"]},
+        ("kind",),
+    )
+    registry.counter(
+        "horrorchat_traffic_recorded_total", "Апдейты, записанные для replay.py",
+        lambda: ({("recorded",): engine.recorder.recorded, ("dropped",): engine.recorder.dropped}
+                 if engine.recorder else {}),
+        ("result",),
+    )
+    registry.counter(
+        "horrorchat_input_coalescing_total", "Склеенные реплики и отброшенные устаревшие ответы",
+        lambda: {(k,): v for k, v in engine.pending_inputs.stats.items()}, ("result",),
+    )
+    registry.counter(
+        "horrorchat_openai_gateway_total", "Запросы через шлюз OpenAI по результату",
+        lambda: {(k,): v for k, v in engine.gateway.counts.items()}, ("result",),
+    )
+    registry.gauge("horrorchat_openai_circuit_open", "Цепь к OpenAI разомкнута (1) или нет (0)",
+                   lambda: int(engine.gateway.breaker.state != "closed"))
+    registry.counter(
+        "horrorchat_fallback_replies_total", "Запасные реплики вместо ответа модели",
+        lambda: {(k,): v for k, v in engine.fallbacks.stats.items()}, ("reason",),
+    )
+    registry.gauge("horrorchat_outbox_queue", "Сообщения в очереди на отправку",
+                   lambda: engine.outbox.stats()["queued"])
+    registry.counter(
+        "horrorchat_outbox_total", "Результаты отправки сообщений",
+        lambda: {(k,): v for k, v in engine.outbox.stats().items() if k in ("sent", "failed", "retried")},
+        ("result",),
+    )
+    registry.counter("horrorchat_outbox_throttled_seconds_total", "Время ожидания лимитов Telegram",
+                     lambda: engine.outbox.stats()["throttled_seconds"])
+    registry.counter(
+        "horrorchat_reply_bank_total", "Обращения к банку готовых ответов",
+        lambda: ({(k,): v for k, v in engine.reply_bank.stats().items() if k != "entries"}
+                 if engine.reply_bank else {}),
+        ("result",),
+    )
+    registry.counter(
+        "horrorchat_reply_cache_total", "Обращения к кэшу ответов",
+        lambda: {(k,): v for k, v in engine.reply_cache.stats().items() if k in ("hits", "misses", "evictions")},
+        ("result",),
+    )
@@ -0,0 +1,270 @@
+import asyncio
+import random
+import threading
+import time
+
+
+class GatewayBusy(Exception):
+    # Свободный слот не нашёлся за wait_timeout
+    pass
+
+
+class CircuitOpen(Exception):
+    # Модель недавно отвечала ошибками подряд — запросы временно не отправляются
+    pass
+
+
+def is_transient(error):
+    # Ошибки, после которых имеет смысл повторить запрос
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError,
+                          openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    # closed — запросы идут; после failure_threshold ошибок подряд — open,
+    # и reset_timeout секунд запросы сразу отклоняются; затем half_open —
+    # пропускается один пробный запрос, и по его результату цепь
+    # закрывается или снова размыкается
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                self._probe = False
+            if self._probe:
+                return False
+            self._probe = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe = False
+
+    def release_probe(self):
+        # Пробный запрос так и не был отправлен
+        with self._lock:
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe = False
+
+
+class _Stream:
+    # Потоковый ответ держит слот, пока его не дочитают или не закроют
+    def __init__(self, gateway, response):
+        self._gateway = gateway
+        self._response = response
+        self._chunks = iter(response)
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self._finish(ok=True)
+            raise
+        except Exception:
+            self._finish(ok=False)
+            raise
+
+    def close(self):
+        self._finish(ok=None)
+
+    def _finish(self, ok):
+        if self._closed:
+            return
+        self._closed = True
+        close = getattr(self._response, "close", None)
+        if close is not None:
+            close()
+        if ok is True:
+            self._gateway.breaker.record_success()
+        elif ok is False:
+            self._gateway.breaker.record_failure()
+        else:
+            # Поток закрыли, не дочитав (игрок написал ещё): исход неизвестен,
+            # и если это был пробный запрос, следующий должен получить шанс
+            self._gateway.breaker.release_probe()
+        self._gateway._slots.release()
+
+
+class ModelGateway:
+    # Все запросы к модели идут через шлюз:
+    # - не больше max_concurrency одновременных запросов; слот ждём не дольше wait_timeout
+    # - у каждой попытки свой таймаут call_timeout
+    # - временные ошибки повторяются до retries раз с экспоненциальной паузой и джиттером,
+    #   пока укладываемся в общий бюджет budget секунд
+    # - при серии ошибок размыкается CircuitBreaker
+    def __init__(self, create, max_concurrency=16, wait_timeout=2.0, call_timeout=15.0,
+                 retries=2, backoff=0.5, budget=30.0, breaker=None):
+        self.create = create
+        self.max_concurrency = max_concurrency
+        self.wait_timeout = wait_timeout
+        self.call_timeout = call_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.budget = budget
+        self.breaker = breaker or CircuitBreaker()
+        self.counts = {"ok": 0, "error": 0, "retried": 0, "busy": 0, "open": 0}
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _retry_pause(self, error, attempt, started):
+        # Пауза перед повтором или None, если повторять не нужно
+        pause = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        elapsed = time.monotonic() - started
+        if (attempt >= self.retries or not is_transient(error)
+                or elapsed + pause + self.call_timeout > self.budget):
+            self._count("error")
+            self.breaker.record_failure()
+            return None
+        self._count("retried")
+        return pause
+
+    def call(self, **kwargs):
+        if not self.breaker.allow():
+            self._count("open")
+            raise CircuitOpen("Модель временно недоступна")
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            self._count("busy")
+            self.breaker.release_probe()
+            raise GatewayBusy(f"Нет свободного слота за {self.wait_timeout} с")
+        released = False
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self.create(timeout=self.call_timeout, **kwargs)
+                except Exception as e:
+                    pause = self._retry_pause(e, attempt, started)
+                    if pause is None:
+                        raise
+                    attempt += 1
+                    time.sleep(pause)
+                    continue
+                self._count("ok")
+                if kwargs.get("stream"):
+                    # Слот освобождает _Stream, когда поток закончится
+                    released = True
+                    return _Stream(self, response)
+                self.breaker.record_success()
+                return response
+        finally:
+            if not released:
+                self._slots.release()
+
+
+class _AsyncStream(_Stream):
+    def __init__(self, gateway, response):
+        self._gateway = gateway
+        self._response = response
+        self._chunks = response.__aiter__()
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            await self._finish_async(ok=True)
+            raise
+        except Exception:
+            await self._finish_async(ok=False)
+            raise
+
+    async def aclose(self):
+        await self._finish_async(ok=None)
+
+    async def _finish_async(self, ok):
+        if self._closed:
+            return
+        close = getattr(self._response, "close", None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+        self._response = None
+        self._finish(ok)
+
+
+class AsyncModelGateway(ModelGateway):
+    # Тот же шлюз для асинхронного клиента: create — корутина,
+    # слоты — asyncio.Semaphore. Вызывать из потока цикла событий
+    def __init__(self, create, max_concurrency=16, wait_timeout=2.0, call_timeout=15.0,
+                 retries=2, backoff=0.5, budget=30.0, breaker=None):
+        super().__init__(create, max_concurrency, wait_timeout, call_timeout, retries, backoff, budget, breaker)
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def call(self, **kwargs):
+        if not self.breaker.allow():
+            self._count("open")
+            raise CircuitOpen("Модель временно недоступна")
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._count("busy")
+            self.breaker.release_probe()
+            raise GatewayBusy(f"Нет свободного слота за {self.wait_timeout} с") from None
+        released = False
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = await asyncio.wait_for(
+                        self.create(timeout=self.call_timeout, **kwargs), self.call_timeout
+                    )
+                except Exception as e:
+                    pause = self._retry_pause(e, attempt, started)
+                    if pause is None:
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(pause)
+                    continue
+                self._count("ok")
+                if kwargs.get("stream"):
+                    released = True
+                    return _AsyncStream(self, response)
+                self.breaker.record_success()
+                return response
+        finally:
+            if not released:
+                self._slots.release()
@@ -0,0 +1,336 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import threading
+import time
+from types import SimpleNamespace
+
+# Нагрузочный стенд: синтетические апдейты Telegram отправляются в /webhook,
+# а bot и client в main.py подменяются локальными заглушками с настраиваемой
+# задержкой и долей ошибок. Работает без сети.
+#
+#   python loadtest.py --chats 200 --messages 3 --openai-latency 0.8 --json before.json
+
+REPLY_MARKER = "⟨stub⟩"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50) * 1000, 1),
+        "p95": round(percentile(values, 95) * 1000, 1),
+        "p99": round(percentile(values, 99) * 1000, 1),
+    }
+
+
+class Stats:
+    # Общие измерения прогона: задержки вебхука, время до ответа игроку,
+    # отправленные сообщения и пиковые значения потоков и памяти.
+    # coalesced — реплики склеиваются (INPUT_COALESCE_WINDOW > 0): один ответ
+    # закрывает все реплики чата, которые его ждали
+    def __init__(self, coalesced=False):
+        self.coalesced = coalesced
+        self.webhook = []
+        self.replies = []
+        self.statuses = {}
+        self.sent = 0
+        self.send_errors = 0
+        self.peak_threads = 0
+        self.peak_rss_mb = 0.0
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def webhook_done(self, seconds, status):
+        with self._lock:
+            self.webhook.append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def expect_reply(self, chat_id):
+        with self._lock:
+            self._waiting.setdefault(chat_id, []).append(time.monotonic())
+
+    def message_sent(self, chat_id, text):
+        with self._lock:
+            self.sent += 1
+            waiting = self._waiting.get(chat_id)
+            if waiting and (REPLY_MARKER in text or text == "…"):
+                now = time.monotonic()
+                answered = len(waiting) if self.coalesced else 1
+                self.replies.extend(now - asked for asked in waiting[:answered])
+                del waiting[:answered]
+
+    def send_failed(self):
+        with self._lock:
+            self.send_errors += 1
+
+    def sample(self):
+        with self._lock:
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+    def report(self, elapsed):
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "webhook_ms": summarize(self.webhook),
+            "reply_ms": summarize(self.replies),
+            "unanswered": sum(len(waiting) for waiting in self._waiting.values()),
+            "webhook_statuses": self.statuses,
+            "sent_messages": self.sent,
+            "send_errors": self.send_errors,
+            "sent_per_second": round(self.sent / elapsed, 1) if elapsed else 0.0,
+            "peak_threads": self.peak_threads,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StubBot:
+    # Заглушка telegram.Bot: только методы, которые вызывает бот
+    username = "loadtest_bot"
+
+    def __init__(self, stats, latency=0.05, error_rate=0.0):
+        self.stats = stats
+        self.latency = latency
+        self.error_rate = error_rate
+        self._ids = itertools.count(1)
+
+    def _call(self, chat_id, text=None):
+        from telegram.error import RetryAfter
+
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.error_rate:
+            self.stats.send_failed()
+            raise RetryAfter(1)
+        if text is not None:
+            self.stats.message_sent(chat_id, text)
+        return SimpleNamespace(message_id=next(self._ids), chat_id=chat_id, text=text)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._call(chat_id, text)
+
+    def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        return self._call(chat_id, text)
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        self._call(chat_id)
+        return True
+
+    def send_chat_action(self, chat_id, action, **kwargs):
+        return self._call(chat_id)
+
+
+class _Completions:
+    def __init__(self, latency, jitter, error_rate):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+
+    def create(self, messages, stream=False, **kwargs):
+        self.calls += 1
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.error_rate:
+            raise RuntimeError("stub OpenAI error")
+        text = f"Майкл: ответ на «{messages[-1]['content'][:20]}» {REPLY_MARKER}"
+        if stream:
+            return iter(_chunk(part) for part in (text[:10], text[10:]))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class StubOpenAI:
+    # Заглушка OpenAI-клиента: client.chat.completions.create(...)
+    def __init__(self, latency=0.8, jitter=0.3, error_rate=0.0):
+        self.chat = SimpleNamespace(completions=_Completions(latency, jitter, error_rate))
+
+    @property
+    def calls(self):
+        return self.chat.completions.calls
+
+
+def prepare_env(delay_scale, continue_delay):
+    # Переменные окружения для main.py — до его импорта
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:LOADTEST")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    os.environ.setdefault("STATE_BACKEND", "memory")
+    os.environ.setdefault("STATE_SNAPSHOT_PATH", "")
+    os.environ["DELAY_SCALE"] = str(delay_scale)
+    os.environ["CONTINUE_DELAY"] = str(continue_delay)
+
+
+def install_stubs(app, bot, client):
+    app.bot = bot
+    app.outbox.bot = bot
+    app.client = client
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def make(self, chat_id, text):
+        update_id = next(self._ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+
+def post_update(http, stats, data):
+    started = time.monotonic()
+    response = http.post("/webhook", json=data)
+    stats.webhook_done(time.monotonic() - started, response.status_code)
+    return response.status_code
+
+
+PHRASES = ["кто там?", "пойдём отсюда", "ок", "мне страшно", "что это было?", "Майкл, ты где?", "давайте уйдём"]
+
+
+def play_chat(app, stats, factory, chat_id, messages, think):
+    # Сценарий одного игрока: /start, несколько реплик, /stop, /continue и ещё реплика
+    http = app.app.test_client()
+    post_update(http, stats, factory.make(chat_id, "/start"))
+    time.sleep(random.uniform(0, think))
+    for _ in range(messages):
+        time.sleep(random.uniform(0.5, 1.5) * think)
+        stats.expect_reply(chat_id)
+        post_update(http, stats, factory.make(chat_id, random.choice(PHRASES)))
+    post_update(http, stats, factory.make(chat_id, "/stop"))
+    time.sleep(think)
+    post_update(http, stats, factory.make(chat_id, "/continue"))
+    stats.expect_reply(chat_id)
+    post_update(http, stats, factory.make(chat_id, random.choice(PHRASES)))
+
+
+def is_idle(app):
+    # Апдейты обработаны (включая те, что сейчас у воркеров), нет ни таймеров
+    # проигрывания и склейки, ни реплик, ждущих ответа модели, ни сообщений
+    # в очереди или в полёте
+    outbox = app.outbox.stats()
+    return (
+        all(q.unfinished_tasks == 0 for q in app.workers.queues)
+        and app.scheduler.pending() == 0
+        and not app.pending_inputs
+        and outbox["queued"] == 0
+        and outbox["inflight"] == 0
+    )
+
+
+def wait_idle(app, timeout):
+    # Дважды подряд: сработавшее событие таймера могло ещё не успеть
+    # поставить следующее
+    deadline = time.monotonic() + timeout
+    idle = 0
+    while time.monotonic() < deadline:
+        idle = idle + 1 if is_idle(app) else 0
+        if idle >= 2:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def start_sampler(stats, stop):
+    def run():
+        while not stop.is_set():
+            stats.sample()
+            stop.wait(0.1)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def run(args):
+    prepare_env(args.delay_scale, args.continue_delay)
+    import main as app
+
+    stats = Stats(app.INPUT_COALESCE_WINDOW > 0)
+    install_stubs(
+        app,
+        StubBot(stats, args.telegram_latency, args.telegram_errors),
+        StubOpenAI(args.openai_latency, args.openai_jitter, args.openai_errors),
+    )
+    factory = UpdateFactory()
+    stop = threading.Event()
+    start_sampler(stats, stop)
+
+    started = time.monotonic()
+    players = [
+        threading.Thread(target=play_chat, args=(app, stats, factory, 100000 + i, args.messages, args.think))
+        for i in range(args.chats)
+    ]
+    for i, player in enumerate(players):
+        player.start()
+        if args.ramp:
+            time.sleep(args.ramp / args.chats)
+    for player in players:
+        player.join()
+    drained = wait_idle(app, args.drain_timeout)
+    elapsed = time.monotonic() - started
+    stop.set()
+
+    result = stats.report(elapsed)
+    # False — бот не затих за --drain-timeout, часть ответов не досчитана
+    result["drained"] = drained
+    result["openai_calls"] = app.client.calls
+    result["outbox"] = app.outbox.stats()
+    result["reply_cache"] = app.reply_cache.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на заглушках Telegram и OpenAI")
+    parser.add_argument("--chats", type=int, default=100, help="число одновременных чатов")
+    parser.add_argument("--messages", type=int, default=3, help="реплик игрока до /stop")
+    parser.add_argument("--think", type=float, default=1.0, help="пауза игрока между сообщениями, с")
+    parser.add_argument("--ramp", type=float, default=1.0, help="за сколько секунд подключаются все чаты")
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--openai-jitter", type=float, default=0.3)
+    parser.add_argument("--openai-errors", type=float, default=0.0, help="доля ошибок OpenAI, 0..1")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-errors", type=float, default=0.0, help="доля ответов 429, 0..1")
+    parser.add_argument("--delay-scale", type=float, default=0.02, help="множитель пауз из story.py")
+    parser.add_argument("--continue-delay", type=float, default=0.2)
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="сохранить результат в файл для сравнения прогонов")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
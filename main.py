@@ -1,193 +1,550 @@
-import os
+import sys
 import time
+import atexit
+import signal
+import logging
 import threading
-from flask import Flask, request
-from dotenv import load_dotenv
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import Flask, Response, jsonify, request
 from telegram import Bot, Update
+from telegram.utils.request import Request
 from telegram.ext import Dispatcher, CommandHandler, MessageHandler, Filters
-from openai import OpenAI
-from story import story
-
-# Загрузка переменных окружения
-load_dotenv()
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-client = OpenAI(api_key=OPENAI_API_KEY)
+from story_loader import load_story
+from workers import UpdateWorkers
+from scheduler import Scheduler
+from story_index import StoryIndex
+from state_store import UserStates, open_state_store
+from reply_cache import ReplyCache
+from reply_bank import open_reply_bank
+from outbox import Outbox, PRIORITY_REPLY, PRIORITY_STORY
+from dialogue import DialogueMemory, clip
+from metrics import Registry, timed
+from gpt_gateway import CircuitBreaker, CircuitOpen, GatewayBusy, ModelGateway
+from playback import next_block, next_line, pending_block
+from dedup import RecentKeys
+from traffic import TrafficRecorder
+from tracing import Tracer
+from profiler import ProfilerBusy, folded, sample
+from engine_common import Fallbacks, PendingInputs, check_admin, register_metrics, reply_context
+from config import (
+    ADMIN_TOKEN, CONTEXT_TOKEN_BUDGET, CONTINUE_DELAY, DELAY_SCALE, DIALOGUE_MAX_TURNS, DIALOGUE_SUMMARY_BUDGET,
+    DIALOGUE_TOKEN_BUDGET, GPT_STREAMING, INPUT_COALESCE_MAX_WAIT, INPUT_COALESCE_WINDOW, INPUT_TOKEN_BUDGET,
+    OPENAI_API_KEY, OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET, OPENAI_BUDGET, OPENAI_MAX_CONCURRENCY,
+    OPENAI_RETRIES, OPENAI_TIMEOUT, OPENAI_WAIT_TIMEOUT, OUTBOX_CHAT_RATE, OUTBOX_GLOBAL_RATE, OUTBOX_SENDERS,
+    PLAYBACK_COALESCE, PLAYBACK_START_WINDOW, PLAYBACK_TYPING, PLAYBACK_TYPING_BEAT, PLAYBACK_WORKERS,
+    PROFILE_MAX_SECONDS, REPLY_BANK_PATH, REPLY_BANK_THRESHOLD, REPLY_CACHE_MAX_BYTES, REPLY_CACHE_SHORT_TOKENS,
+    REPLY_CACHE_TTL, REPLY_CACHE_VARIANTS, STATE_BACKEND, STATE_DB_PATH, STATE_FLUSH_INTERVAL, STATE_IDLE_TTL,
+    STATE_MAX_ACTIVE, STATE_SNAPSHOT_PATH, STORY_COMPILED_DIR, STORY_SOURCE, STREAM_EDIT_INTERVAL, TELEGRAM_API_URL,
+    TELEGRAM_BOT_TOKEN, TRACE_BUFFER_SIZE, TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_SALT, TRAFFIC_RECORD_TEXT,
+    UPDATE_DEDUP_MAX, UPDATE_DEDUP_WINDOW, UPDATE_QUEUE_SIZE, UPDATE_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Метрики в формате Prometheus, отдаются на /metrics
+registry = Registry()
+webhook_seconds = registry.histogram("horrorchat_webhook_seconds", "Время обработки запроса /webhook")
+handler_seconds = registry.histogram("horrorchat_handler_seconds", "Время работы обработчиков", ("handler",))
+openai_seconds = registry.histogram("horrorchat_openai_seconds", "Задержка запросов к OpenAI", ("mode", "result"))
+telegram_seconds = registry.histogram(
+    "horrorchat_telegram_seconds", "Задержка запросов к Telegram Bot API", ("method", "result")
+)
+# Спаны обработки апдейтов, отдаются на /debug/traces
+tracer = Tracer(TRACE_BUFFER_SIZE)
+
+# Клиент OpenAI создаётся при первом запросе или заранее, уже после того,
+# как бот начал принимать вебхуки (boot.py): импорт openai — самая долгая
+# часть старта процесса
+client = None
+_client_lock = threading.Lock()
+
+def init_openai():
+    global client
+    with _client_lock:
+        if client is None:
+            from openai import OpenAI
+
+            # Повторы делает шлюз, поэтому у клиента свои отключены
+            client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return client
+
+gateway = ModelGateway(
+    lambda **kwargs: (client or init_openai()).chat.completions.create(**kwargs),
+    OPENAI_MAX_CONCURRENCY, OPENAI_WAIT_TIMEOUT, OPENAI_TIMEOUT, OPENAI_RETRIES,
+    budget=OPENAI_BUDGET, breaker=CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET),
+)
 app = Flask(__name__)
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+# Один пул keep-alive соединений на всех отправителей и воркеров
+# (и ещё одно — для getUpdates в polling.py)
+bot = Bot(
+    token=TELEGRAM_BOT_TOKEN, base_url=f"{TELEGRAM_API_URL}/bot",
+    request=Request(con_pool_size=OUTBOX_SENDERS + UPDATE_WORKERS + 1),
+)
 dispatcher = Dispatcher(bot, None, use_context=True)
-
-user_states = {}
-user_locks = {}
+# Ответы на склеенные реплики ждут модель, поэтому идут в свой пул по числу
+# слотов шлюза, а не в пул таймеров, где проигрываются строки истории
+reply_pool = ThreadPoolExecutor(max_workers=OPENAI_MAX_CONCURRENCY, thread_name_prefix="reply")
+scheduler = Scheduler(PLAYBACK_WORKERS)
+story = load_story(STORY_COMPILED_DIR, STORY_SOURCE)
+story_index = StoryIndex(story, CONTEXT_TOKEN_BUDGET)
+dialogue = DialogueMemory(DIALOGUE_TOKEN_BUDGET, DIALOGUE_MAX_TURNS, DIALOGUE_SUMMARY_BUDGET)
+reply_cache = ReplyCache(REPLY_CACHE_MAX_BYTES, REPLY_CACHE_TTL, REPLY_CACHE_VARIANTS)
+reply_bank = open_reply_bank(REPLY_BANK_PATH, STORY_SOURCE, REPLY_BANK_THRESHOLD)
+outbox = Outbox(
+    bot, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_SENDERS,
+    observe=lambda method, seconds, ok: telegram_seconds.observe(seconds, method, "ok" if ok else "error"),
+    tracer=tracer,
+)
+
+def can_evict(user_id):
+    # Чат с запланированными событиями или неотвеченными репликами из памяти не выгружаем
+    if user_id in pending_inputs:
+        return False
+    return not any(scheduler.is_scheduled((user_id, kind)) for kind in ("playback", "continue", "input"))
+
+# Проигрывание, прерванное рестартом, не должно блокировать шаг навсегда
+user_states = UserStates(
+    open_state_store(STATE_BACKEND, STATE_DB_PATH), STATE_FLUSH_INTERVAL,
+    transient={"step_completed": True},
+    idle_ttl=STATE_IDLE_TTL, max_active=STATE_MAX_ACTIVE, can_evict=can_evict,
+)
+
+# Неотвеченные реплики игроков, которые копятся в окне склейки
+pending_inputs = PendingInputs(INPUT_COALESCE_WINDOW, INPUT_COALESCE_MAX_WAIT)
+fallbacks = Fallbacks(story_index)
+# Повторные доставки: увиденные update_id и недавние /start по чатам
+seen_updates = RecentKeys(UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_MAX)
+recent_starts = RecentKeys(PLAYBACK_START_WINDOW)
+duplicate_stats = {"continue": 0}
+# Запись трафика для replay.py — только если задан TRAFFIC_RECORD_PATH
+recorder = TrafficRecorder(TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_SALT, TRAFFIC_RECORD_TEXT) if TRAFFIC_RECORD_PATH else None
 
 def get_user_state(user_id):
-    if user_id not in user_locks:
-        user_locks[user_id] = threading.Lock()
-    return user_states.setdefault(user_id, {
-        "scene": "ep1_intro",
-        "step": 0,
-        "line_index": 0,
-        "step_completed": True,
-        "paused": False  # <-- добавили
-    })
-def collect_context(scene, step_index):
-    context = []
-    for i in range(step_index):
-        step = scene["steps"][i]
-        for line in step.get("characters", []):
-            context.append(f'{line["name"]}: {line["line"]}')
-    return "\n".join(context)
-
-def gpt_reply(scene, step_index, user_input):
-    step = scene["steps"][step_index]
-    characters = step.get("characters", [])
-    character_names = [c["name"] for c in characters]
-    context_text = collect_context(scene, step_index)
-
-    # Используем кастомный промпт, если есть
-    prompt = step.get("prompt_hint")
-    if not prompt:
-        prompt = f"""
-Ты — один из следующих персонажей: {', '.join(character_names)}.
-Алекс — главная героиня. Пользователь играет за неё и пишет от её имени.
-
-Контекст истории:
-{context_text}
-
-Ответь очень коротко и естественно от имени одного из этих персонажей. Не описывай действия. Не добавляй ничего лишнего. Не отвечай от имени Алекс. Формат:
-Имя: реплика
-"""
+    return user_states.get(user_id)
+
+@contextmanager
+def user_lock(user_id):
+    # Ожидание лока чата попадает в трассировку, только если лок был занят
+    lock = user_states.lock(user_id)
+    if not lock.acquire(blocking=False):
+        with tracer.span("lock_wait", chat_id=user_id):
+            lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def collect_context(scene_name, step_index):
+    return story_index.scene(scene_name).context(step_index)
+
+def gpt_request(scene_name, step_index, user_input, state=None, **kwargs):
+    # Промпт шага уже собран индексом: кастомный prompt_hint или промпт
+    # по умолчанию с контекстом и целями персонажей. К нему добавляется
+    # выжимка и последние реплики диалога игрока — всё в пределах лимитов токенов
+    with tracer.span("context", scene=scene_name, step=step_index):
+        prompt = story_index.scene(scene_name).prompt(step_index)
+        messages = dialogue.request(prompt, state, user_input, INPUT_TOKEN_BUDGET)
+    mode = "stream" if kwargs.get("stream") else "full"
+    started = time.perf_counter()
+    try:
+        with tracer.span("openai", mode=mode):
+            response = gateway.call(
+                model="gpt-3.5-turbo",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=100,
+                **kwargs
+            )
+    except (CircuitOpen, GatewayBusy):
+        raise
+    except Exception:
+        openai_seconds.observe(time.perf_counter() - started, mode, "error")
+        raise
+    openai_seconds.observe(time.perf_counter() - started, mode, "ok")
+    return response
+
+def gpt_reply(scene_name, step_index, user_input, state=None):
+    cacheable, state = reply_context(dialogue, state, user_input, REPLY_CACHE_SHORT_TOKENS)
+    cached = reply_cache.get(scene_name, step_index, user_input) if cacheable else None
+    if cached is not None:
+        return cached
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": user_input}
-            ],
-            temperature=0.7,
-            max_tokens=100
-        )
-        return response.choices[0].message.content.strip()
+        response = gpt_request(scene_name, step_index, user_input, state)
+        reply = response.choices[0].message.content.strip()
     except Exception as e:
-        return f"Ошибка GPT: {str(e)}"
+        return fallbacks.reply(scene_name, step_index, user_input, e)
+
+    # Запасные реплики в кэш не попадают — только ответы модели
+    if cacheable:
+        reply_cache.put(scene_name, step_index, user_input, reply)
+    return reply
+
+def gpt_reply_stream(scene_name, step_index, user_input, state=None):
+    # Отдаёт ответ модели кусками по мере генерации
+    stream = gpt_request(scene_name, step_index, user_input, state, stream=True)
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Освобождаем слот шлюза, даже если стрим оборвали
+        stream.close()
+
+def send_reply(chat_id, text):
+    # Ответы игроку уходят раньше строк сценария
+    return outbox.send(chat_id, PRIORITY_REPLY, text=text)
+
+def edit_reply(chat_id, message_id, text):
+    return outbox.send(chat_id, PRIORITY_REPLY, method="edit_message_text", message_id=message_id, text=text)
+
+def drop_placeholder(chat_id, future):
+    # Заглушку не дождались и ответили обычным сообщением: если она всё же
+    # дошла, удаляем её, чтобы в чате не осталось лишнее «…»
+    if not future.cancelled() and future.exception() is None:
+        outbox.send(chat_id, PRIORITY_REPLY, method="delete_message", message_id=future.result().message_id)
+
+def stream_reply(chat_id, scene_name, step_index, user_input, state=None, superseded=None):
+    # Сначала отправляем заглушку, затем правим её по мере прихода токенов,
+    # но не чаще раза в STREAM_EDIT_INTERVAL секунд (лимит правок в чате).
+    # Если игрок успел написать ещё (superseded), стрим обрывается,
+    # заглушка удаляется и возвращается None
+    cacheable, state = reply_context(dialogue, state, user_input, REPLY_CACHE_SHORT_TOKENS)
+    cached = reply_cache.get(scene_name, step_index, user_input) if cacheable else None
+    if cached is not None:
+        send_reply(chat_id, cached)
+        return cached
+
+    sent = send_reply(chat_id, "…")
+    try:
+        placeholder = sent.result(timeout=10)
+    except Exception:
+        sent.add_done_callback(functools.partial(drop_placeholder, chat_id))
+        reply = gpt_reply(scene_name, step_index, user_input, state)
+        send_reply(chat_id, reply)
+        return reply
+
+    shown = "…"
+    text = ""
+    last_edit = time.monotonic()
+    chunks = gpt_reply_stream(scene_name, step_index, user_input, state)
+    try:
+        for chunk in chunks:
+            if superseded is not None and superseded():
+                chunks.close()
+                outbox.send(chat_id, PRIORITY_REPLY, method="delete_message", message_id=placeholder.message_id)
+                return None
+            text += chunk
+            if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL and text.strip():
+                shown = text.strip()
+                edit_reply(chat_id, placeholder.message_id, shown)
+                last_edit = time.monotonic()
+        text = text.strip()
+    except Exception:
+        logger.exception("Ошибка потокового ответа GPT")
+        text = ""
+
+    if text:
+        if cacheable:
+            reply_cache.put(scene_name, step_index, user_input, text)
+    else:
+        # Стрим не удался — обычный запрос без стриминга
+        text = gpt_reply(scene_name, step_index, user_input, state)
+    if text != shown:
+        edit_reply(chat_id, placeholder.message_id, text)
+    return text
+
 def send_remaining_lines(user_id, chat_id):
-    def run():
-        state = get_user_state(user_id)
-        if state.get("paused", False):  # Если пользователь поставил паузу
+    # Запускает проигрывание текущего шага, если оно ещё не идёт
+    state = get_user_state(user_id)
+    with user_lock(user_id):
+        if state.paused:  # Если пользователь поставил паузу
             return
-        if not state.get("step_completed", True):  # Если предыдущий step ещё не завершён
+        if not state.step_completed:  # Если предыдущий step ещё не завершён
             return
+        state.step_completed = False  # Блокируем до завершения step
+    scheduler.schedule((user_id, "playback"), 0, play_next_line, user_id, chat_id)
 
-        state["step_completed"] = False  # Блокируем до завершения step
-
-        scene = story[state["scene"]]
-        steps = scene["steps"]
-
-        while state["step"] < len(steps):
-            step = steps[state["step"]]
-            characters = step.get("characters", [])
-            delay = step.get("delay", 7)
-
-            # Если есть текст, отправим его один раз курсивом
-            if "text" in step and state["line_index"] == 0:
-                bot.send_message(
-                    chat_id=chat_id,
-                    text=f"_{step['text']}_",
-                    parse_mode="Markdown"
-                )
-                time.sleep(delay)
-                state["line_index"] = -1 if not characters else 0
-                if not characters:
-                    break  # Переходим к следующему step позже
-
-            # Отправляем реплики персонажей
-            while state["line_index"] < len(characters):
-                if state.get("paused", False):
-                    return  # если пользователь нажал стоп во время отправки
-                line = characters[state["line_index"]]
-                bot.send_message(chat_id=chat_id, text=f'{line["name"]}: {line["line"]}')
-                state["line_index"] += 1
-                time.sleep(delay)
-
-            # Переход к следующему шагу
-            state["step"] += 1
-            state["line_index"] = 0
-            break  # Завершаем после одного шага
-
-        state["step_completed"] = True  # Разрешаем следующий шаг
-
-    threading.Thread(target=run).start()
-
-def continue_story(user_id, chat_id):
-    if user_id not in user_locks:
-        user_locks[user_id] = threading.Lock()
-    def run():
-        with user_locks[user_id]:
-            send_remaining_lines(user_id, chat_id)
-    threading.Thread(target=run).start()
+def play_next_line(user_id, chat_id, typed=None):
+    # Одно событие проигрывания: отправляет очередную строку шага (или в склеенном
+    # режиме весь остаток шага) и планирует следующее через delay вместо time.sleep.
+    # typed — часть паузы, уже показанная как «печатает…» перед этим событием
+    state = get_user_state(user_id)
+    with user_lock(user_id):
+        if state.paused:  # если пользователь нажал стоп во время отправки
+            return
+
+        steps = story[state.scene].steps
+        # Шаг отмечается отправленным только вместе с самим сообщением,
+        # поэтому /stop во время «печатает…» ничего не теряет
+        typing = (PLAYBACK_COALESCE and PLAYBACK_TYPING and typed is None
+                  and pending_block(state, steps) is not None)
+        if typing:
+            beat = min(PLAYBACK_TYPING_BEAT, steps[state.step].delay) * DELAY_SCALE
+        else:
+            line = next_block(state, steps) if PLAYBACK_COALESCE else next_line(state, steps)
+            if line is None:
+                return
+            text, parse_mode, delay = line
+
+    if typing:
+        outbox.send(chat_id, PRIORITY_STORY, method="send_chat_action", action="typing")
+        scheduler.schedule((user_id, "playback"), beat, play_next_line, user_id, chat_id, beat)
+        return
+    outbox.send(chat_id, PRIORITY_STORY, text=text, parse_mode=parse_mode)
+    scheduler.schedule((user_id, "playback"), delay * DELAY_SCALE - (typed or 0.0), play_next_line, user_id, chat_id)
+
+def delayed_continue(user_id, chat_id):
+    state = get_user_state(user_id)
+    if not state.paused:
+        send_remaining_lines(user_id, chat_id)
+
+def cancel_events(user_id):
+    scheduler.cancel((user_id, "playback"))
+    scheduler.cancel((user_id, "continue"))
 
 def start(update, context):
     user_id = update.message.chat_id
-    user_states[user_id] = {"scene": "ep1_intro", "step": 0, "line_index": 0}
+    # Повторный /start сразу после первого (двойное нажатие) историю не перезапускает
+    if recent_starts.seen(user_id):
+        return
+    state = get_user_state(user_id)
+    with user_lock(user_id):
+        cancel_events(user_id)
+        scheduler.cancel((user_id, "input"))
+        pending_inputs.discard(user_id)
+        state.reset()
     send_remaining_lines(user_id, update.message.chat_id)
 def stop(update, context):
     user_id = update.message.chat_id
     state = get_user_state(user_id)
-    state["paused"] = True
-    update.message.reply_text("⏸️ История приостановлена. Напиши /continue, чтобы продолжить.")
+    with user_lock(user_id):
+        state.paused = True
+        # Снимаем запланированные события; позиция внутри шага сохраняется,
+        # и /continue доиграет шаг с того же места
+        cancel_events(user_id)
+        state.step_completed = True
+    send_reply(user_id, "⏸️ История приостановлена. Напиши /continue, чтобы продолжить.")
 
 def continue_command(update, context):
     user_id = update.message.chat_id
     state = get_user_state(user_id)
-    state["paused"] = False
-    update.message.reply_text("▶️ Продолжаем...")
-    continue_story(user_id, update.message.chat_id)
+    with user_lock(user_id):
+        # Шаг уже проигрывается — повторный /continue ничего не делает
+        if not state.paused and not state.step_completed:
+            duplicate_stats["continue"] += 1
+            return
+        state.paused = False
+    send_reply(user_id, "▶️ Продолжаем...")
+    send_remaining_lines(user_id, update.message.chat_id)
 
 
+def answer_player(user_id, user_input, superseded=None):
+    # Ответ GPT на реплику игрока. Возвращает False, если отвечать не нужно:
+    # история закончилась или игрок уже написал что-то новое
+    state = get_user_state(user_id)
+    scene_name = state.scene
+    step_index = state.step
+
+    if step_index >= story_index.scene(scene_name).size:
+        return False
+
+    if GPT_STREAMING:
+        reply = stream_reply(user_id, scene_name, step_index, user_input, state, superseded)
+        if reply is None:
+            return False
+    else:
+        reply = gpt_reply(scene_name, step_index, user_input, state)
+        if superseded is not None and superseded():
+            return False
+        send_reply(user_id, reply)
+
+    remember_reply(user_id, state, user_input, reply)
+    return True
+
+def answer_from_bank(user_id, user_input):
+    # Частая реплика, для которой на этом шаге есть готовый ответ, — без модели
+    state = get_user_state(user_id)
+    if state.step >= story_index.scene(state.scene).size:
+        return False
+    reply = reply_bank.get(state.scene, state.step, user_input)
+    if reply is None:
+        return False
+    send_reply(user_id, reply)
+    remember_reply(user_id, state, user_input, reply)
+    return True
+
+def remember_reply(user_id, state, user_input, reply):
+    # Запоминаем реплики для следующих запросов
+    with user_lock(user_id):
+        dialogue.add(state, "user", clip(user_input, INPUT_TOKEN_BUDGET))
+        dialogue.add(state, "assistant", reply)
+
+    # ⏳ Планируем отложенное продолжение через 10 секунд
+    scheduler.schedule((user_id, "continue"), CONTINUE_DELAY, delayed_continue, user_id, user_id)
+
+def flush_input(user_id):
+    # Все реплики, накопленные за окно, уходят в модель одним запросом
+    # (как буфер отбрасывает устаревшие ответы — PendingInputs в engine_common.py)
+    with user_lock(user_id):
+        batch = pending_inputs.take(user_id)
+    if batch is None:
+        return
+
+    delivered = answer_player(user_id, "\n".join(batch.texts), batch.superseded)
+    with user_lock(user_id):
+        pending_inputs.done(user_id, batch, delivered)
+
+def schedule_flush(user_id):
+    # Таймер окна склейки только передаёт реплики в пул ответов
+    reply_pool.submit(contextvars.copy_context().run, run_flush, user_id)
+
+def run_flush(user_id):
+    try:
+        flush_input(user_id)
+    except Exception:
+        logger.exception("Ошибка ответа на реплики игрока")
+
 def handle_message(update, context):
     user_id = update.message.chat_id
     user_input = update.message.text.strip()
-    state = get_user_state(user_id)
-
-    # Отменяем отложенное продолжение, если оно уже запущено
-    if "continue_timer" in state and state["continue_timer"]:
-        state["continue_timer"].cancel()
-        state["continue_timer"] = None
-
-    scene = story[state["scene"]]
-    step_index = state["step"]
-
-    if step_index < len(scene["steps"]):
-        reply = gpt_reply(scene, step_index, user_input)
-        update.message.reply_text(reply)
 
-        # Завершаем шаг (если нужно)
-        if not state.get("step_completed"):
-            state["step_completed"] = True
-
-        # ⏳ Устанавливаем отложенное продолжение через 10 секунд
-        def delayed_continue():
-            if not state.get("paused", False):
-                send_remaining_lines(user_id, update.message.chat_id)
-            state["continue_timer"] = None  # сбросить флаг
-
-        timer = threading.Timer(10.0, delayed_continue)
-        state["continue_timer"] = timer
-        timer.start()
+    # Отменяем отложенное продолжение, если оно уже запланировано
+    scheduler.cancel((user_id, "continue"))
+
+    # Готовый ответ уходит сразу, не дожидаясь окна склейки
+    if reply_bank is not None and user_id not in pending_inputs and answer_from_bank(user_id, user_input):
+        return
+
+    if INPUT_COALESCE_WINDOW <= 0:
+        answer_player(user_id, user_input)
+        return
+
+    # Копим реплики: каждое новое сообщение сдвигает окно, но не дальше
+    # INPUT_COALESCE_MAX_WAIT от первого сообщения пачки
+    with user_lock(user_id):
+        delay = pending_inputs.add(user_id, user_input, time.monotonic())
+    scheduler.schedule((user_id, "input"), delay, schedule_flush, user_id)
+
+def process_update(update):
+    # Всё, что делается ради этого апдейта (в том числе запланированное
+    # и поставленное в Outbox), попадает в трассировку с его update_id
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    with tracer.bind(update.update_id, chat_id), tracer.span("dispatch"):
+        dispatcher.process_update(update)
+
+workers = UpdateWorkers(process_update, UPDATE_WORKERS, UPDATE_QUEUE_SIZE)
+
+def enqueue_update(data, done=None):
+    # Общая точка входа апдейта: вебхук, воркер-процесс в шардированном режиме,
+    # polling.py. False — очередь переполнена. Повторная доставка уже принятого
+    # апдейта сразу подтверждается и не обрабатывается. done() вызывается,
+    # когда апдейт обработан (или отброшен как повтор)
+    update_id = data.get("update_id")
+    if seen_updates.seen(update_id):
+        if done is not None:
+            done()
+        return True
+    update = Update.de_json(data, bot)
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    if not workers.submit(chat_id, update, done):
+        seen_updates.forget(update_id)
+        return False
+    return True
 
 @app.route("/webhook", methods=["POST"])
+@timed(webhook_seconds)
 def webhook():
-    update = Update.de_json(request.get_json(force=True), bot)
-    dispatcher.process_update(update)
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict) or "update_id" not in data:
+        return "bad request", 400
+    if recorder is not None:
+        recorder.record(data)
+
+    # Очередь переполнена — отвечаем 429, Telegram повторит доставку позже
+    with tracer.span("webhook", update_id=data["update_id"]):
+        accepted = enqueue_update(data)
+    if not accepted:
+        return "busy", 429, {"Retry-After": "1"}
     return "ok"
 
-dispatcher.add_handler(CommandHandler("start", start))
-dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
-dispatcher.add_handler(CommandHandler("stop", stop))
-dispatcher.add_handler(CommandHandler("continue", continue_command))
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+def admin_only(view):
+    # Отладочные ручки: без ADMIN_TOKEN их нет, без верного токена — 403
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        denied = check_admin(request.headers.get("X-Admin-Token"), ADMIN_TOKEN)
+        if denied is not None:
+            status, text = denied
+            return text, status
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/debug/traces")
+@admin_only
+def debug_traces():
+    # /debug/traces?update_id=...&chat_id=...&limit=... — спаны от старых к новым
+    spans = tracer.export(
+        request.args.get("update_id", type=int), request.args.get("chat_id", type=int),
+        request.args.get("limit", 1000, type=int),
+    )
+    return jsonify({"recorded": tracer.recorded, "spans": spans})
+
+@app.route("/debug/profile")
+@admin_only
+def debug_profile():
+    # /debug/profile?seconds=10 — стеки всех потоков за это время в формате
+    # folded stacks: flamegraph.pl profile.txt > profile.svg
+    seconds = min(request.args.get("seconds", 10.0, type=float), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get("interval", 0.01, type=float), 0.001)
+    try:
+        stacks = sample(seconds, interval)
+    except ProfilerBusy:
+        return "profile already running", 409
+    return Response(folded(stacks), mimetype="text/plain")
+
+register_metrics(registry, sys.modules[__name__])
+registry.gauge("horrorchat_update_queue", "Апдейты в очереди на обработку", workers.pending)
+registry.counter("horrorchat_updates_rejected_total", "Апдейты, отклонённые из-за переполнения", lambda: workers.rejected)
+
+dispatcher.add_handler(CommandHandler("start", timed(handler_seconds, "start")(start)))
+dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, timed(handler_seconds, "handle_message")(handle_message)))
+dispatcher.add_handler(CommandHandler("stop", timed(handler_seconds, "stop")(stop)))
+dispatcher.add_handler(CommandHandler("continue", timed(handler_seconds, "continue_command")(continue_command)))
+def restore_hot_state():
+    # Чаты из снимка прошлой остановки — в память, их эпизоды истории — в индекс,
+    # чтобы первые после рестарта сообщения не ждали хранилища и диска
+    restored = user_states.restore(STATE_SNAPSHOT_PATH) if STATE_SNAPSHOT_PATH else []
+    for scene in {state.scene for state in restored}:
+        if scene in story:
+            story_index.scene(scene)
+    return len(restored)
+
+def save_state():
+    # Несброшенные состояния — в хранилище, горячие чаты — в снимок
+    user_states.flush()
+    if STATE_SNAPSHOT_PATH:
+        user_states.snapshot(STATE_SNAPSHOT_PATH)
+
+workers.start()
+scheduler.start()
+user_states.start()
+outbox.start()
+atexit.register(save_state)
+if recorder is not None:
+    recorder.start()
+    atexit.register(recorder.flush)
 
 if __name__ == "__main__":
+    # При остановке дино сохраняем несброшенные состояния через atexit
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    restore_hot_state()
+    init_openai()
     app.run(host="0.0.0.0", port=10000)
 
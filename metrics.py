@@ -0,0 +1,115 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    # Запись — поиск корзины и инкремент под коротким локом,
+    # поэтому гистограммы можно держать включёнными всегда
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_text = _labels_text(self.labels + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _labels_text(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {values[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Callback:
+    # Значение считается только в момент запроса /metrics.
+    # fn возвращает число или словарь {значения меток: число}
+    def __init__(self, name, help, fn, type="gauge", labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.type = type
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                if not isinstance(labels, tuple):
+                    labels = (labels,)
+                lines.append(f"{self.name}{_labels_text(self.labels, labels)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, labels=()):
+        self._metrics.append(Callback(name, help, fn, "gauge", labels))
+
+    def counter(self, name, help, fn, labels=()):
+        self._metrics.append(Callback(name, help, fn, "counter", labels))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram, *labels):
+    # Декоратор: время выполнения функции попадает в гистограмму
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(*labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,292 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Чем меньше число, тем раньше уходит сообщение
+PRIORITY_REPLY = 0
+PRIORITY_STORY = 1
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        # Сколько секунд ждать до появления свободного токена
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class _Chat:
+    __slots__ = ("items", "next_allowed", "inflight", "token")
+
+    def __init__(self):
+        self.items = []
+        self.next_allowed = 0.0
+        self.inflight = False
+        self.token = 0
+
+
+class Outbox:
+    # Единая точка отправки сообщений в Telegram.
+    # Общий лимит (~30 сообщений/с) — токен-бакет, лимит чата (~1 сообщение/с) —
+    # минимальный интервал между отправками в один чат. Внутри чата сообщения
+    # уходят строго по одному в порядке приоритета, затем очереди; ответы GPT
+    # обгоняют строки сценария. На 429 сообщение возвращается в очередь
+    # и чат ждёт retry_after секунд. observe(method, seconds, ok) вызывается
+    # после каждого обращения к API — для метрик; tracer (tracing.Tracer)
+    # получает спан отправки с апдейтом, из-за которого она была поставлена.
+    def __init__(self, bot, global_rate=30, chat_rate=1, senders=4, max_retries=3, observe=None, tracer=None):
+        self.bot = bot
+        self.observe = observe
+        self.tracer = tracer
+        self.chat_interval = 1.0 / chat_rate
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled_seconds = 0.0
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._waiting = []   # (время готовности, token, chat_id)
+        self._runnable = []  # (приоритет, seq, token, chat_id)
+        self._queued = 0
+        self._inflight = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=senders, thread_name_prefix="outbox")
+        self._last_sweep = time.monotonic()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def send(self, chat_id, priority, method="send_message", **kwargs):
+        # Возвращает Future с результатом вызова метода бота
+        future = Future()
+        with self._cond:
+            item = (priority, next(self._seq), method, kwargs, future, time.monotonic(), 0, self._trace())
+            self._push(chat_id, item)
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": self._queued,
+                "inflight": self._inflight,
+                "chats": len(self._chats),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+            }
+
+    def _trace(self):
+        return self.tracer.current() if self.tracer else None
+
+    def _push(self, chat_id, item, not_before=0.0):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat()
+        head = chat.items[0] if chat.items else None
+        heapq.heappush(chat.items, item)
+        self._queued += 1
+        chat.next_allowed = max(chat.next_allowed, not_before)
+        # Перепланируем чат, если он простаивал или новое сообщение важнее головы очереди
+        if not chat.inflight and (head is None or item < head or not_before):
+            self._schedule(chat_id, chat)
+
+    def _schedule(self, chat_id, chat):
+        chat.token += 1
+        heapq.heappush(self._waiting, (chat.next_allowed, chat.token, chat_id))
+
+    def _poll(self):
+        # Сообщение, которое можно отправить прямо сейчас, или сколько ждать
+        # до следующей проверки (None — пока не придёт новое сообщение)
+        now = time.monotonic()
+        self._sweep(now)
+        while self._waiting and self._waiting[0][0] <= now:
+            _, token, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats.get(chat_id)
+            if chat is not None and chat.token == token and chat.items:
+                priority, seq = chat.items[0][:2]
+                heapq.heappush(self._runnable, (priority, seq, token, chat_id))
+
+        while self._runnable:
+            _, _, token, chat_id = self._runnable[0]
+            chat = self._chats.get(chat_id)
+            if chat is not None and chat.token == token and chat.items and not chat.inflight:
+                break
+            heapq.heappop(self._runnable)
+
+        if self._runnable:
+            wait = self._global.delay(now)
+            if wait > 0:
+                return None, wait
+            _, _, _, chat_id = heapq.heappop(self._runnable)
+            chat = self._chats[chat_id]
+            item = heapq.heappop(chat.items)
+            self._queued -= 1
+            self._global.take(now)
+            chat.inflight = True
+            self._inflight += 1
+            chat.next_allowed = now + self.chat_interval
+            self.throttled_seconds += now - item[5]
+            return (chat_id, item), 0.0
+
+        return None, (self._waiting[0][0] - now if self._waiting else None)
+
+    def _next_item(self):
+        while True:
+            ready, wait = self._poll()
+            if ready is not None:
+                return ready
+            self._cond.wait(wait)
+
+    def _sweep(self, now):
+        # Забываем чаты без сообщений, у которых уже истёк интервал лимита
+        if now - self._last_sweep < 10:
+            return
+        self._last_sweep = now
+        idle = [
+            chat_id for chat_id, chat in self._chats.items()
+            if not chat.items and not chat.inflight and chat.next_allowed <= now
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                chat_id, item = self._next_item()
+            self._pool.submit(self._deliver, chat_id, item)
+
+    def _deliver(self, chat_id, item):
+        started = time.monotonic()
+        try:
+            result = getattr(self.bot, item[2])(chat_id=chat_id, **item[3])
+        except Exception as e:
+            self._done(chat_id, item, started, error=e)
+        else:
+            self._done(chat_id, item, started, result=result)
+
+    def _done(self, chat_id, item, started, result=None, error=None):
+        # Итог обращения к API: результат в future или повтор после 429
+        priority, seq, method, kwargs, future, queued_at, attempts, trace = item
+        finished = time.monotonic()
+        if self.observe:
+            self.observe(method, finished - started, error is None)
+        if self.tracer:
+            # queued_ms — ожидание в очереди и лимитах Telegram до запроса
+            self.tracer.record(
+                f"telegram.{method}", time.time() - (finished - started), finished - started, trace,
+                chat_id=chat_id, queued_ms=round((started - queued_at) * 1000, 3), attempt=attempts,
+                error=type(error).__name__ if error is not None else None,
+            )
+        retry_at = 0.0
+        if error is not None:
+            retry_after = getattr(error, "retry_after", None)
+            if retry_after is not None and attempts < self.max_retries:
+                retry_at = time.monotonic() + retry_after
+            else:
+                logger.warning("Не удалось выполнить %s для чата %s: %s", method, chat_id, error)
+                with self._cond:
+                    self.failed += 1
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            with self._cond:
+                self.sent += 1
+            if not future.done():
+                future.set_result(result)
+
+        with self._cond:
+            chat = self._chats[chat_id]
+            chat.inflight = False
+            self._inflight -= 1
+            if retry_at:
+                self.retried += 1
+                retry = (priority, seq, method, kwargs, future, time.monotonic(), attempts + 1, trace)
+                self._push(chat_id, retry, not_before=retry_at)
+            elif chat.items:
+                self._schedule(chat_id, chat)
+            self._cond.notify()
+
+
+def _retrieve_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+class AsyncOutbox(Outbox):
+    # Те же лимиты и очереди, но для цикла asyncio: send() возвращает
+    # asyncio.Future, методы бота — корутины, одновременно в полёте
+    # не больше senders запросов. Все вызовы — из потока цикла событий
+    def __init__(self, bot, global_rate=30, chat_rate=1, senders=64, max_retries=3, observe=None, tracer=None):
+        super().__init__(bot, global_rate, chat_rate, senders, max_retries, observe, tracer)
+        self.senders = senders
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.senders)
+        self._task = asyncio.get_running_loop().create_task(self._run_async())
+
+    def send(self, chat_id, priority, method="send_message", **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        # Ошибку отправки ждут не все — без этого asyncio предупреждал бы о ней
+        future.add_done_callback(_retrieve_exception)
+        with self._cond:
+            item = (priority, next(self._seq), method, kwargs, future, time.monotonic(), 0, self._trace())
+            self._push(chat_id, item)
+        self._wakeup.set()
+        return future
+
+    async def _run_async(self):
+        while True:
+            with self._cond:
+                ready, wait = self._poll()
+            if ready is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            asyncio.get_running_loop().create_task(self._deliver_async(*ready))
+
+    async def _deliver_async(self, chat_id, item):
+        started = time.monotonic()
+        try:
+            result = await getattr(self.bot, item[2])(chat_id=chat_id, **item[3])
+        except Exception as e:
+            self._done(chat_id, item, started, error=e)
+        else:
+            self._done(chat_id, item, started, result=result)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
@@ -0,0 +1,73 @@
+import re
+
+# Лимит длины сообщения Bot API; длиннее склеенный шаг уходит построчно
+MESSAGE_LIMIT = 4096
+_MARKDOWN_V2_SPECIAL = re.compile(r"([_*\[\]()~`>#+\-=|{}.!\\])")
+
+
+def escape_markdown(text):
+    # Экранирование для MarkdownV2: реплики из story.py — обычный текст
+    return _MARKDOWN_V2_SPECIAL.sub(r"\\\1", text)
+
+
+def next_line(state, steps):
+    # Одно событие проигрывания шага: narrated и line_index показывают,
+    # что из шага уже отправлено. Возвращает (текст, parse_mode, пауза из story.py)
+    # для очередной строки или None, если шаг доигран (или история закончилась)
+    # и можно переходить к следующему
+    if state.step >= len(steps):
+        state.step_completed = True
+        return None
+
+    step = steps[state.step]
+    characters = step.characters
+
+    # Если есть текст, отправим его один раз курсивом
+    if step.text and not state.narrated:
+        state.narrated = True
+        return f"_{step.text}_", "Markdown", step.delay
+    # Отправляем реплики персонажей
+    if state.line_index < len(characters):
+        line = characters[state.line_index]
+        state.line_index += 1
+        return f"{line.name}: {line.line}", None, step.delay
+
+    # Пауза после последней строки выдержана — переход к следующему шагу
+    state.step += 1
+    state.line_index = 0
+    state.narrated = False
+    state.step_completed = True  # Разрешаем следующий шаг
+    return None
+
+
+def pending_block(state, steps):
+    # Всё, что ещё не отправлено из текущего шага, одним сообщением MarkdownV2:
+    # описание курсивом, затем реплики с именами жирным.
+    # (текст, число склеенных строк) или None, если отправлять нечего
+    if state.step >= len(steps):
+        return None
+    step = steps[state.step]
+    parts = []
+    if step.text and not state.narrated:
+        parts.append(f"_{escape_markdown(step.text)}_")
+    for line in step.characters[state.line_index:]:
+        parts.append(f"*{escape_markdown(line.name)}:* {escape_markdown(line.line)}")
+    if not parts:
+        return None
+    return "\n\n".join(parts), len(parts)
+
+
+def next_block(state, steps):
+    # Склеенное проигрывание: одно событие отправляет остаток шага целиком,
+    # следующее завершает шаг. Пауза — сумма пауз склеенных строк, поэтому
+    # шаг длится столько же, сколько при построчной отправке
+    block = pending_block(state, steps)
+    if block is None:
+        return next_line(state, steps)
+    text, count = block
+    if len(text) > MESSAGE_LIMIT:
+        return next_line(state, steps)
+    step = steps[state.step]
+    state.narrated = True
+    state.line_index = len(step.characters)
+    return text, "MarkdownV2", step.delay * count
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+from config import POLLING_BATCH, POLLING_METRICS_PORT, POLLING_OFFSET_PATH, POLLING_TIMEOUT
+
+# Режим long polling для стендов без публичного HTTPS-вебхука:
+#
+#   python polling.py
+#
+# Апдейты забираются пачками через getUpdates и идут через ту же
+# enqueue_update, что и вебхук: пул воркеров обрабатывает разные чаты
+# параллельно, а апдейты одного чата — по порядку. Для проверки без сети
+# TELEGRAM_API_URL можно направить на локальную заглушку Bot API
+# (bot_api_stub.py).
+#
+# Следующий getUpdates подтверждает Telegram всю предыдущую пачку, поэтому
+# перед ним offset и ещё не обработанные апдейты записываются в файл.
+# После рестарта они обрабатываются первыми, а уже обработанные не повторяются.
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    # offset для getUpdates и апдейты, которые приняты, но ещё не обработаны
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.pending = {}
+        self._saved = None
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.offset = int(data.get("offset", 0))
+            self.pending = {update["update_id"]: update for update in data.get("pending", [])}
+
+    def accept(self, data):
+        with self._lock:
+            self.pending[data["update_id"]] = data
+            self.offset = max(self.offset, data["update_id"] + 1)
+
+    def finish(self, update_id):
+        with self._lock:
+            self.pending.pop(update_id, None)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"offset": self.offset, "pending": [self.pending[k] for k in sorted(self.pending)]}
+        if data == self._saved:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self._saved = data
+
+
+class Poller:
+    # Цикл getUpdates. Таймаут long polling подстраивается под трафик:
+    # полная пачка — сразу за следующей (timeout 0), неполная — короткое
+    # ожидание, серия пустых ответов — ожидание на сервере растёт
+    # до max_timeout, чтобы не крутить пустые запросы
+    def __init__(self, app, batch=100, max_timeout=25, checkpoint_path=None):
+        self.app = app
+        self.batch = batch
+        self.max_timeout = max_timeout
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.timeout = 0
+        self.polls = 0
+        self.received = 0
+        self.running = True
+
+    def fetch(self, offset, timeout):
+        # Сырые апдейты (dict), без разбора в telegram.Update — их разбирает enqueue_update
+        bot = self.app.bot
+        data = {"offset": offset, "limit": self.batch, "timeout": timeout}
+        return bot.request.post(f"{bot.base_url}/getUpdates", data, timeout=timeout + 5)
+
+    def submit(self, data):
+        update_id = data["update_id"]
+        self.checkpoint.accept(data)
+        done = lambda: self.checkpoint.finish(update_id)  # noqa: E731
+        # Очередь воркеров переполнена — ждём, пока она разойдётся
+        while not self.app.enqueue_update(data, done):
+            if not self.running:
+                return False
+            time.sleep(0.05)
+        self.received += 1
+        return True
+
+    def resume(self):
+        # Апдейты, которые не успели обработать до рестарта
+        pending = [self.checkpoint.pending[k] for k in sorted(self.checkpoint.pending)]
+        if pending:
+            logger.info("Дообрабатываем %s апдейтов из %s", len(pending), self.checkpoint.path)
+        for data in pending:
+            self.submit(data)
+
+    def poll_once(self):
+        # Всё принятое записано до того, как getUpdates подтвердит его Telegram
+        self.checkpoint.save()
+        updates = self.fetch(self.checkpoint.offset, self.timeout)
+        self.polls += 1
+        for data in updates:
+            if data["update_id"] < self.checkpoint.offset:
+                continue
+            if not self.submit(data):
+                break
+
+        if len(updates) >= self.batch:
+            self.timeout = 0
+        elif updates:
+            self.timeout = 1
+        else:
+            self.timeout = min(self.max_timeout, max(1, self.timeout * 2))
+        return len(updates)
+
+    def run(self):
+        self.resume()
+        errors = 0
+        while self.running:
+            try:
+                self.poll_once()
+                errors = 0
+            except RetryAfter as e:
+                time.sleep(e.retry_after)
+            except (NetworkError, TimedOut) as e:
+                # Сеть или Bot API недоступны — повторяем с нарастающей паузой
+                errors += 1
+                delay = min(30, 2 ** errors)
+                logger.warning("getUpdates не удался (%s), повтор через %s с", e, delay)
+                time.sleep(delay)
+
+    def stop(self):
+        self.running = False
+
+    def drain(self, timeout=10.0):
+        # Ждём, пока воркеры доработают принятые апдейты, и сохраняем остаток
+        deadline = time.monotonic() + timeout
+        while len(self.checkpoint) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.checkpoint.save()
+
+
+def main():
+    import main as app
+
+    # getUpdates не работает, пока у бота установлен вебхук
+    app.bot.delete_webhook()
+    app.restore_hot_state()
+    app.init_openai()
+    poller = Poller(app, POLLING_BATCH, POLLING_TIMEOUT, POLLING_OFFSET_PATH)
+    app.registry.counter("horrorchat_polling_updates_total", "Апдейты, полученные через getUpdates",
+                         lambda: poller.received)
+    app.registry.counter("horrorchat_polling_requests_total", "Запросы getUpdates", lambda: poller.polls)
+    app.registry.gauge("horrorchat_polling_pending", "Принятые и ещё не обработанные апдейты",
+                       lambda: len(poller.checkpoint))
+    if POLLING_METRICS_PORT:
+        threading.Thread(
+            target=app.app.run, kwargs={"host": "0.0.0.0", "port": POLLING_METRICS_PORT},
+            name="metrics-http", daemon=True,
+        ).start()
+
+    def shutdown(*args):
+        poller.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    try:
+        poller.run()
+    finally:
+        poller.drain()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
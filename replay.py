@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loadtest import Stats, StubBot, StubOpenAI, install_stubs, prepare_env, start_sampler, wait_idle
+from traffic import read_traffic
+
+# Повторный прогон записанного трафика (traffic.py) на заглушках Telegram и OpenAI.
+# Апдейты отправляются в /webhook с теми же интервалами, что в записи, сжатыми
+# в --speed раз; паузы истории, окно склейки и отложенное продолжение сжимаются
+# так же, поэтому форма нагрузки сохраняется. Задержки заглушек не сжимаются.
+#
+#   python replay.py traffic.jsonl --speed 10 --json friday-x10.json
+
+
+def compress_env(speed):
+    # Пауз из story.py и таймеров бота — в speed раз короче. До импорта main.py
+    def scaled(name, default):
+        os.environ[name] = str(float(os.getenv(name, default)) / speed)
+
+    scaled("CONTINUE_DELAY", "10")
+    scaled("INPUT_COALESCE_WINDOW", "1.5")
+    scaled("INPUT_COALESCE_MAX_WAIT", "4")
+    scaled("PLAYBACK_START_WINDOW", "3")
+
+
+def is_player_text(update):
+    message = update.get("message") or {}
+    text = message.get("text")
+    return isinstance(text, str) and not text.startswith("/")
+
+
+def run(args):
+    records = read_traffic(args.log)
+    if args.limit:
+        records = records[:args.limit]
+    compress_env(args.speed)
+    prepare_env(1.0 / args.speed, os.environ["CONTINUE_DELAY"])
+    # Запись не должна писать сама себя
+    os.environ["TRAFFIC_RECORD_PATH"] = ""
+    import main as app
+
+    stats = Stats(app.INPUT_COALESCE_WINDOW > 0)
+    install_stubs(
+        app,
+        StubBot(stats, args.telegram_latency, args.telegram_errors),
+        StubOpenAI(args.openai_latency, args.openai_jitter, args.openai_errors),
+    )
+    stop = threading.Event()
+    start_sampler(stats, stop)
+
+    local = threading.local()
+    lags = []
+
+    def post(due, update):
+        http = getattr(local, "http", None)
+        if http is None:
+            http = local.http = app.app.test_client()
+        lags.append(time.monotonic() - due)
+        message = update.get("message") or {}
+        if is_player_text(update):
+            stats.expect_reply(message["chat"]["id"])
+        started = time.monotonic()
+        response = http.post("/webhook", json=update)
+        stats.webhook_done(time.monotonic() - started, response.status_code)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for offset, update in records:
+            due = started + offset / args.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(post, due, update)
+    feed_elapsed = time.monotonic() - started
+    drained = wait_idle(app, args.drain_timeout)
+    elapsed = time.monotonic() - started
+    stop.set()
+
+    recorded_span = records[-1][0] if records else 0.0
+    result = stats.report(elapsed)
+    result.update({
+        "drained": drained,
+        "speed": args.speed,
+        "updates": len(records),
+        "recorded_span_s": round(recorded_span, 1),
+        "feed_s": round(feed_elapsed, 2),
+        "updates_per_second": round(len(records) / feed_elapsed, 1) if feed_elapsed else 0.0,
+        "lag_ms": {
+            "p50": round(sorted(lags)[len(lags) // 2] * 1000, 1) if lags else 0.0,
+            "max": round(max(lags) * 1000, 1) if lags else 0.0,
+        },
+        "openai_calls": app.client.calls,
+        "duplicates": {
+            "update": app.seen_updates.duplicates,
+            "start": app.recent_starts.duplicates,
+            "continue": app.duplicate_stats["continue"],
+        },
+        "outbox": app.outbox.stats(),
+        "reply_cache": app.reply_cache.stats(),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Повторный прогон записанного трафика на заглушках")
+    parser.add_argument("log", help="файл записи TRAFFIC_RECORD_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение времени: 1, 10, 100")
+    parser.add_argument("--limit", type=int, default=0, help="взять только первые N апдейтов")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных запросов к /webhook")
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--openai-jitter", type=float, default=0.3)
+    parser.add_argument("--openai-errors", type=float, default=0.0, help="доля ошибок OpenAI, 0..1")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-errors", type=float, default=0.0, help="доля ответов 429, 0..1")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="сохранить результат в файл для сравнения прогонов")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from reply_cache import normalize
+
+logger = logging.getLogger(__name__)
+
+# Банк заранее сгенерированных ответов: для каждого шага истории и каждого
+# частого намерения игрока — несколько ответов модели. В рантайме реплика
+# игрока классифицируется локально по символьным n-граммам, и при уверенном
+# совпадении ответ берётся из банка без обращения к модели.
+#
+#   python reply_bank.py --out reply_bank.json           # через OpenAI
+#   python reply_bank.py --out reply_bank.json --stub    # на заглушке, без сети
+
+# Намерение -> примеры реплик. Первая реплика отправляется в модель при сборке банка
+INTENTS = {
+    "who": ["кто это?", "кто там?", "ты кто?", "кто вы такие", "а это кто", "кто он такой"],
+    "leave": ["пойдём отсюда", "давайте уйдём", "уходим", "валим отсюда", "валим", "надо уезжать",
+              "поехали отсюда"],
+    "scared": ["мне страшно", "я боюсь", "жутко тут", "мне не по себе", "страшно", "мне очень страшно"],
+    "what": ["что это было?", "что происходит?", "что случилось", "что это", "что за звук"],
+    "where": ["где мы?", "ты где?", "где все?", "куда мы идём", "где это мы"],
+    "help": ["надо позвать на помощь", "помогите", "вызовем полицию", "давай позвоним кому нибудь"],
+    "agree": ["ок", "да", "хорошо", "ладно", "согласна", "давай"],
+    "refuse": ["нет", "не надо", "я не пойду", "ни за что", "не хочу"],
+    "greet": ["привет", "всем привет", "привет ребята"],
+}
+
+
+def ngrams(text, n=3):
+    # Символьные n-граммы нормализованного текста с границами слов
+    text = f" {normalize(text)} "
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+class IntentMatcher:
+    # Косинусная близость по n-граммам с ближайшим примером каждого намерения.
+    # Обратный индекс n-грамма -> примеры, поэтому сравнение идёт только
+    # с примерами, у которых есть общие n-граммы с репликой. Реплика, которая
+    # лишь делит слово с примером («давай позвоним маме», «страшно интересно»),
+    # набирает 0.6–0.7, поэтому порог уверенности в ReplyBank — 0.75
+    def __init__(self, intents=INTENTS, n=3, margin=0.1):
+        self.n = n
+        self.margin = margin
+        self.examples = []
+        self.norms = []
+        self.index = {}
+        for intent, phrases in intents.items():
+            for phrase in phrases:
+                grams = ngrams(phrase, n)
+                i = len(self.examples)
+                self.examples.append(intent)
+                self.norms.append(math.sqrt(sum(c * c for c in grams.values())))
+                for gram, count in grams.items():
+                    self.index.setdefault(gram, []).append((i, count))
+
+    def match(self, text):
+        # (намерение, уверенность 0..1) или (None, 0.0)
+        grams = ngrams(text, self.n)
+        norm = math.sqrt(sum(c * c for c in grams.values()))
+        if not norm:
+            return None, 0.0
+        dots = {}
+        for gram, count in grams.items():
+            for i, weight in self.index.get(gram, ()):
+                dots[i] = dots.get(i, 0) + count * weight
+        best = {}
+        for i, dot in dots.items():
+            score = dot / (norm * self.norms[i])
+            intent = self.examples[i]
+            if score > best.get(intent, 0.0):
+                best[intent] = score
+        if not best:
+            return None, 0.0
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        # Реплика, почти одинаково похожая на два намерения, не считается уверенной
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < self.margin:
+            return None, 0.0
+        return ranked[0]
+
+
+class ReplyBank:
+    # Ответы по (сцена, шаг, намерение). Банк, собранный для другой версии
+    # story.py, не используется: номера шагов могли сдвинуться
+    def __init__(self, data, matcher=None, threshold=0.75):
+        self.source_hash = data.get("source_hash")
+        self.replies = data.get("replies", {})
+        self.matcher = matcher or IntentMatcher(data.get("intents", INTENTS))
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, threshold=0.75):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), threshold=threshold)
+
+    def __len__(self):
+        return sum(len(steps) for steps in self.replies.values())
+
+    def get(self, scene_name, step_index, user_input):
+        intent, score = self.matcher.match(user_input)
+        replies = None
+        if intent is not None and score >= self.threshold:
+            replies = self.replies.get(scene_name, {}).get(str(step_index), {}).get(intent)
+        with self._lock:
+            if replies:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return random.choice(replies) if replies else None
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self), "hits": self.hits, "misses": self.misses}
+
+
+def open_reply_bank(path, source, threshold=0.75):
+    # Банк из файла или None, если его нет или он собран для другой версии story.py
+    if not path or not os.path.exists(path):
+        return None
+    bank = ReplyBank.load(path, threshold)
+    from story_compiler import source_hash
+
+    if bank.source_hash != source_hash(source):
+        logger.warning("Банк ответов %s собран для другой версии story.py и не используется", path)
+        return None
+    return bank
+
+
+def build_bank(story_index, scene_names, ask, intents=INTENTS, variants=2, concurrency=4):
+    # ask(prompt, user_input) -> ответ модели. Для каждого шага каждой сцены
+    # и каждого намерения собирается variants ответов
+    jobs = []
+    for scene_name in scene_names:
+        index = story_index.scene(scene_name)
+        for step_index in range(index.size):
+            for intent, phrases in intents.items():
+                for variant in range(variants):
+                    phrase = phrases[variant % len(phrases)]
+                    jobs.append((scene_name, step_index, intent, index.prompt(step_index), phrase))
+
+    def run(job):
+        scene_name, step_index, intent, prompt, phrase = job
+        try:
+            return job, ask(prompt, phrase).strip()
+        except Exception as e:
+            logger.warning("Ответ для %s:%s:%s не получен: %s", scene_name, step_index, intent, e)
+            return job, None
+
+    replies = {}
+    with ThreadPoolExecutor(concurrency) as pool:
+        for (scene_name, step_index, intent, _, _), reply in pool.map(run, jobs):
+            if reply:
+                step = replies.setdefault(scene_name, {}).setdefault(str(step_index), {})
+                bucket = step.setdefault(intent, [])
+                if reply not in bucket:
+                    bucket.append(reply)
+    return replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка банка готовых ответов по шагам истории")
+    parser.add_argument("--out", default="reply_bank.json")
+    parser.add_argument("--compiled", default="compiled_story", help="каталог скомпилированной истории")
+    parser.add_argument("--variants", type=int, default=2, help="ответов на намерение")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--stub", action="store_true", help="заглушка OpenAI из loadtest.py вместо сети")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from dotenv import load_dotenv
+
+    from story_compiler import source_hash
+    from story_index import StoryIndex
+    from story_loader import load_story
+
+    load_dotenv()
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "story.py")
+    story = load_story(args.compiled, source)
+    if args.stub:
+        from loadtest import StubOpenAI
+
+        client = StubOpenAI(latency=0.0, jitter=0.0)
+    else:
+        from openai import OpenAI
+
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    def ask(prompt, user_input):
+        response = client.chat.completions.create(
+            model=args.model,
+            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": user_input}],
+            temperature=0.9,
+            max_tokens=100,
+        )
+        return response.choices[0].message.content
+
+    replies = build_bank(StoryIndex(story), list(story), ask, variants=args.variants,
+                         concurrency=args.concurrency)
+    data = {"source_hash": source_hash(source), "intents": INTENTS, "replies": replies}
+    tmp = args.out + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, args.out)
+    count = sum(len(intents) for steps in replies.values() for intents in steps.values())
+    print(f"Шагов: {sum(len(steps) for steps in replies.values())}, ответов по намерениям: {count} -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
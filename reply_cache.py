@@ -0,0 +1,90 @@
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Частые варианты написания одного и того же слова
+WORD_VARIANTS = {
+    "окей": "ок", "оке": "ок", "окк": "ок", "ok": "ок", "okay": "ок",
+    "че": "что", "чо": "что", "шо": "что", "што": "что",
+    "щас": "сейчас", "ща": "сейчас",
+    "пошли": "пойдем", "идем": "пойдем", "айда": "пойдем",
+    "тут": "здесь",
+    "приветик": "привет", "здравствуйте": "привет", "здрасте": "привет", "хай": "привет",
+    "ага": "да", "угу": "да", "неа": "нет",
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_REPEATS = re.compile(r"(\w)\1{2,}")
+
+
+def normalize(text):
+    text = text.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    text = _REPEATS.sub(r"\1", text)  # "ооочень" -> "очень"
+    return " ".join(WORD_VARIANTS.get(word, word) for word in text.split())
+
+
+class ReplyCache:
+    # LRU-кэш ответов GPT с ограничением по памяти и TTL.
+    # Ключ — (сцена, шаг, нормализованный ввод). На один ключ можно держать
+    # до variants разных ответов: пока пул не заполнен, запрос считается
+    # промахом и идёт в модель, после — отдаётся случайный вариант.
+    def __init__(self, max_bytes=4_000_000, ttl=3600, variants=1):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.variants = variants
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, scene_name, step_index, user_input):
+        key = (scene_name, step_index, normalize(user_input))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None or len(entry[2]) < self.variants:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry[2])
+
+    def put(self, scene_name, step_index, user_input, reply):
+        key = (scene_name, step_index, normalize(user_input))
+        size = len(reply.encode()) + 64
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                size += len(key[2].encode()) + 128
+                entry = [time.monotonic() + self.ttl, 0, []]
+                self._entries[key] = entry
+            elif reply in entry[2] or len(entry[2]) >= self.variants:
+                return
+            entry[1] += size
+            entry[2].append(reply)
+            self._bytes += size
+            self._entries.move_to_end(key)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
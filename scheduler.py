@@ -0,0 +1,132 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    # Один поток-таймер на весь бот вместо спящих потоков на каждого игрока.
+    # События лежат в куче по времени срабатывания; у каждого ключа
+    # (например, (chat_id, "playback")) не больше одного ожидающего события.
+    # Сработавшие события выполняются в небольшом фиксированном пуле
+    # с контекстом (contextvars) момента планирования — как loop.call_later.
+    def __init__(self, workers=4):
+        self._heap = []
+        self._events = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler")
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def schedule(self, key, delay, fn, *args):
+        # Новое событие заменяет уже запланированное для этого ключа
+        fn = functools.partial(contextvars.copy_context().run, fn)
+        with self._cond:
+            due = time.monotonic() + max(0.0, delay)
+            seq = next(self._seq)
+            self._events[key] = (due, seq, fn, args)
+            heapq.heappush(self._heap, (due, seq, key))
+            self._compact()
+            self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            return self._events.pop(key, None) is not None
+
+    def is_scheduled(self, key):
+        with self._cond:
+            return key in self._events
+
+    def pending(self):
+        with self._cond:
+            return len(self._events)
+
+    def _compact(self):
+        # Отменённые и перезапланированные записи удаляются из кучи лениво;
+        # если их накопилось слишком много — пересобираем кучу
+        if len(self._heap) > 2 * len(self._events) + 64:
+            self._heap = [(due, seq, key) for key, (due, seq, _, _) in self._events.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    due, seq, key = self._heap[0]
+                    event = self._events.get(key)
+                    if event is not None and event[1] == seq:
+                        break
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                _, _, fn, args = self._events.pop(key)
+                return fn, args
+
+    def _run(self):
+        while True:
+            fn, args = self._pop_due()
+            self._pool.submit(self._fire, fn, args)
+
+    def _fire(self, fn, args):
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("Ошибка в запланированном событии")
+
+
+class AsyncScheduler:
+    # То же для цикла asyncio: событие — таймер loop.call_later, по срабатыванию
+    # которого запускается корутина fn(*args). Вызывать из потока цикла событий
+    def __init__(self):
+        self._events = {}
+        self._tasks = set()
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    def schedule(self, key, delay, fn, *args):
+        # Новое событие заменяет уже запланированное для этого ключа
+        self.cancel(key)
+        self._events[key] = self._loop.call_later(max(0.0, delay), self._fire, key, fn, args)
+
+    def cancel(self, key):
+        handle = self._events.pop(key, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def is_scheduled(self, key):
+        return key in self._events
+
+    def pending(self):
+        return len(self._events)
+
+    def _fire(self, key, fn, args):
+        del self._events[key]
+        task = self._loop.create_task(fn(*args))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Ошибка в запланированном событии", exc_info=task.exception())
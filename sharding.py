@@ -0,0 +1,218 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+from flask import Flask, Response, request
+
+from config import OUTBOX_GLOBAL_RATE, PORT, SHARD_QUEUE_SIZE, WORKER_PROCESSES
+from metrics import Registry
+
+# Многопроцессный режим на одной машине, без внешнего брокера:
+#
+#   python sharding.py
+#
+# Фронт принимает вебхуки и по консистентному хешу chat_id отправляет апдейт
+# в один из WORKER_PROCESSES процессов, каждый из которых — обычный main.py
+# со своим пулом обработки. Состояние и порядок апдейтов чата остаются на
+# одном воркере; при изменении числа воркеров переезжает ~1/N чатов, а их
+# состояние подхватывается из общего файла SQLite.
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    # Консистентное хеширование с виртуальными узлами
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], "big")
+
+    def add(self, node):
+        for i in range(self.replicas):
+            key = self._hash(f"{node}#{i}")
+            self._nodes[key] = node
+            bisect.insort(self._keys, key)
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            key = self._hash(f"{node}#{i}")
+            if self._nodes.pop(key, None) is not None:
+                self._keys.remove(key)
+
+    def node_for(self, key):
+        if not self._keys:
+            raise LookupError("В кольце нет узлов")
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[self._keys[i]]
+
+
+def update_chat_id(data):
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post",
+                  "my_chat_member", "chat_member", "chat_join_request"):
+        if field in data:
+            return data[field].get("chat", {}).get("id")
+    if "callback_query" in data:
+        return data["callback_query"].get("message", {}).get("chat", {}).get("id")
+    return None
+
+
+def prepare_worker_env(workers):
+    # Воркеры запускаются через spawn и читают config из окружения заново
+    # (ещё при импорте этого модуля как __mp_main__), поэтому окружение
+    # меняется до их запуска; load_dotenv в воркере эти значения не перезапишет.
+    # Общий лимит Telegram делится между воркерами поровну. Снимок горячих
+    # чатов — один файл на процесс бота: воркеры писали бы его одновременно,
+    # поэтому у них он выключен и чаты читаются из хранилища
+    os.environ["OUTBOX_GLOBAL_RATE"] = str(OUTBOX_GLOBAL_RATE / workers)
+    os.environ["STATE_SNAPSHOT_PATH"] = ""
+
+
+def worker_main(name, inbox):
+    # Процесс-воркер: обычный main.py, апдейты приходят из очереди фронта
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    import main as app
+
+    app.init_openai()
+    while True:
+        data = inbox.get()
+        # Свой пул переполнен — ждём; очередь фронта заполнится, и он начнёт отвечать 429
+        while not app.enqueue_update(data):
+            time.sleep(0.05)
+
+
+class Front:
+    def __init__(self, workers, queue_size):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.names = [f"worker-{i}" for i in range(workers)]
+        self.ring = HashRing(self.names)
+        self.queues = {name: self.ctx.Queue(maxsize=queue_size) for name in self.names}
+        self.processes = {}
+        self.restarts = {name: [] for name in self.names}
+        self.routed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        for name in self.names:
+            self._spawn(name)
+        threading.Thread(target=self._supervise, name="shard-supervisor", daemon=True).start()
+
+    def _spawn(self, name):
+        process = self.ctx.Process(target=worker_main, args=(name, self.queues[name]), name=name, daemon=True)
+        process.start()
+        self.processes[name] = process
+
+    def _supervise(self):
+        # Упавший воркер перезапускается с той же очередью, поэтому апдейты не теряются.
+        # Если он падает постоянно — убираем его из кольца, и его чаты переезжают к соседям
+        while True:
+            time.sleep(1)
+            for name, process in list(self.processes.items()):
+                if process.is_alive():
+                    continue
+                now = time.monotonic()
+                recent = [t for t in self.restarts[name] if now - t < 60] + [now]
+                self.restarts[name] = recent
+                if len(recent) > 3:
+                    logger.error("Воркер %s постоянно падает, убираем его из кольца", name)
+                    self.remove(name)
+                    continue
+                logger.warning("Воркер %s завершился (код %s), перезапускаем", name, process.exitcode)
+                self._spawn(name)
+
+    def remove(self, name):
+        # Апдейты из очереди убранного воркера Telegram уже подтвердил (200),
+        # поэтому они уходят тем воркерам, к которым переехали их чаты
+        with self._lock:
+            self.ring.remove(name)
+            inbox = self.queues.pop(name)
+        self.processes.pop(name, None)
+        moved = lost = 0
+        while True:
+            try:
+                data = inbox.get(timeout=0.5)
+            except queue.Empty:
+                break
+            if self.route(data):
+                moved += 1
+            else:
+                lost += 1
+        inbox.close()
+        if moved or lost:
+            logger.warning("Из очереди %s передано соседям %s апдейтов, потеряно %s", name, moved, lost)
+
+    def route(self, data):
+        # Очередь выбирается и пополняется под локом: после remove() в очередь
+        # убранного воркера уже ничего не попадёт
+        with self._lock:
+            try:
+                name = self.ring.node_for(update_chat_id(data))
+            except LookupError:
+                self.rejected += 1
+                return False
+            try:
+                self.queues[name].put_nowait(data)
+            except queue.Full:
+                self.rejected += 1
+                return False
+        self.routed += 1
+        return True
+
+    def queue_sizes(self):
+        sizes = {}
+        with self._lock:
+            queues = list(self.queues.items())
+        for name, q in queues:
+            try:
+                sizes[name] = q.qsize()
+            except NotImplementedError:
+                sizes[name] = -1
+        return sizes
+
+
+def create_app(front):
+    app = Flask(__name__)
+    registry = Registry()
+    registry.gauge("horrorchat_shard_queue", "Апдейты в очереди воркера", front.queue_sizes, ("worker",))
+    registry.gauge("horrorchat_shard_workers", "Живые воркер-процессы",
+                   lambda: sum(p.is_alive() for p in front.processes.values()))
+    registry.counter("horrorchat_shard_routed_total", "Апдейты, переданные воркерам", lambda: front.routed)
+    registry.counter("horrorchat_shard_rejected_total", "Апдейты, отклонённые из-за переполнения",
+                     lambda: front.rejected)
+
+    @app.route("/webhook", methods=["POST"])
+    def webhook():
+        data = request.get_json(force=True, silent=True)
+        if not isinstance(data, dict) or "update_id" not in data:
+            return "bad request", 400
+        if not front.route(data):
+            return "busy", 429, {"Retry-After": "1"}
+        return "ok"
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+if __name__ == "__main__":
+    prepare_worker_env(WORKER_PROCESSES)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    front = Front(WORKER_PROCESSES, SHARD_QUEUE_SIZE)
+    front.start()
+    create_app(front).run(host="0.0.0.0", port=PORT)
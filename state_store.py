@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStateStore:
+    # Хранилище в памяти процесса — для тестов и локального запуска
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        with self._lock:
+            data = self._data.get(user_id)
+        return json.loads(data) if data is not None else None
+
+    def save_many(self, items):
+        with self._lock:
+            self._data.update(items)
+
+    def close(self):
+        pass
+
+
+class SqliteStateStore:
+    # Локальный файл SQLite в режиме WAL: состояние переживает рестарт
+    # и может читаться несколькими процессами одновременно
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_states ("
+            "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM user_states WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, items):
+        now = time.time()
+        rows = [(user_id, data, now) for user_id, data in items.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO user_states (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_state_store(backend, path):
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SqliteStateStore(path)
+    raise ValueError(f"Неизвестный STATE_BACKEND: {backend}")
+
+
+def default_state():
+    return {
+        "scene": "ep1_intro",
+        "step": 0,
+        "line_index": 0,
+        "narrated": False,
+        "step_completed": True,
+        "paused": False,
+        "history": [],
+        "summary": "",
+    }
+
+
+FIELDS = tuple(default_state())
+_FIELD_SET = frozenset(FIELDS)
+
+
+class UserState:
+    # Компактное состояние игрока. Изменение любого поля помечает состояние
+    # «грязным», запись в хранилище происходит пачкой в фоне
+    __slots__ = FIELDS + ("_states", "_user_id", "_seen")
+
+    def __init__(self, states, user_id, data):
+        object.__setattr__(self, "_states", states)
+        object.__setattr__(self, "_user_id", user_id)
+        object.__setattr__(self, "_seen", time.monotonic())
+        for name, value in data.items():
+            if name in _FIELD_SET:
+                object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in _FIELD_SET:
+            self._states.mark_dirty(self._user_id, self)
+
+    def reset(self):
+        for name, value in default_state().items():
+            setattr(self, name, value)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+
+class UserStates:
+    # Кэш состояний с отложенной записью: состояние загружается из хранилища
+    # при первом обращении к чату, а изменённые состояния раз в flush_interval
+    # секунд записываются одной транзакцией. Поля из transient после загрузки
+    # получают заданные значения (например, флаг идущего проигрывания,
+    # которое не переживает рестарт).
+    #
+    # Чаты, к которым не обращались дольше idle_ttl секунд, а также самые давние
+    # сверх max_active выгружаются из памяти вместе со своими локами и при
+    # следующем сообщении загружаются из хранилища заново. can_evict(user_id)
+    # позволяет запретить выгрузку чата, у которого есть незавершённые события.
+    def __init__(self, store, flush_interval=2.0, transient=None,
+                 idle_ttl=1800, max_active=10000, can_evict=None):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.transient = transient or {}
+        self.idle_ttl = idle_ttl
+        self.max_active = max_active
+        self.can_evict = can_evict
+        self.evicted = 0
+        self._states = {}
+        self._locks = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.monotonic()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, user_id):
+        return user_id in self._states
+
+    def get(self, user_id):
+        state = self._states.get(user_id)
+        if state is None:
+            with self._lock:
+                state = self._states.get(user_id)
+                if state is None:
+                    data = default_state()
+                    loaded = self.store.load(user_id)
+                    if loaded:
+                        data.update(loaded)
+                        data.update(self.transient)
+                    state = UserState(self, user_id, data)
+                    self._states[user_id] = state
+        object.__setattr__(state, "_seen", time.monotonic())
+        return state
+
+    def lock(self, user_id):
+        # Лок создаётся только для активного чата и удаляется при его выгрузке
+        lock = self._locks.get(user_id)
+        if lock is None:
+            with self._lock:
+                lock = self._locks.setdefault(user_id, threading.Lock())
+        return lock
+
+    def mark_dirty(self, user_id, state):
+        with self._lock:
+            self._dirty[user_id] = state
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        items = {user_id: json.dumps(state.to_dict(), ensure_ascii=False) for user_id, state in dirty.items()}
+        if items:
+            try:
+                self.store.save_many(items)
+            except Exception:
+                # Не потеряем изменения: попробуем записать их в следующий раз
+                logger.exception("Не удалось сохранить состояния игроков")
+                with self._lock:
+                    for user_id, state in dirty.items():
+                        self._dirty.setdefault(user_id, state)
+        return len(items)
+
+    def snapshot(self, path):
+        # Снимок чатов, которые сейчас в памяти, для быстрого старта после
+        # рестарта. Вызывается после flush(), поэтому совпадает с хранилищем
+        with self._lock:
+            items = {str(user_id): state.to_dict() for user_id, state in self._states.items()}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+        return len(items)
+
+    def restore(self, path):
+        # Загружает снимок в память без обращений к хранилищу. Файл удаляется
+        # сразу: после аварийной остановки устаревший снимок не должен
+        # перезаписать более свежие состояния. Уже загруженные чаты не трогает.
+        # Повреждённый снимок не мешает старту: чаты загрузятся из хранилища
+        if not os.path.exists(path):
+            return []
+        try:
+            with open(path, encoding="utf-8") as f:
+                items = json.load(f)
+            if not isinstance(items, dict):
+                raise ValueError(f"ожидался объект, а не {type(items).__name__}")
+        except (OSError, ValueError) as e:
+            logger.warning("Снимок %s не прочитан, состояния загрузятся из хранилища: %s", path, e)
+            return []
+        finally:
+            os.remove(path)
+        restored = []
+        with self._lock:
+            for key, loaded in items.items():
+                if not key.lstrip("-").isdigit() or not isinstance(loaded, dict):
+                    logger.warning("Пропущена повреждённая запись снимка: %r", key)
+                    continue
+                user_id = int(key)
+                if user_id in self._states:
+                    continue
+                data = default_state()
+                data.update(loaded)
+                data.update(self.transient)
+                state = self._states[user_id] = UserState(self, user_id, data)
+                restored.append(state)
+        return restored
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            by_age = sorted(self._states.items(), key=lambda item: item[1]._seen)
+        overflow = len(by_age) - self.max_active
+        candidates = [
+            user_id for i, (user_id, state) in enumerate(by_age)
+            if i < overflow or now - state._seen > self.idle_ttl
+        ]
+        if not candidates:
+            return 0
+
+        # Перед выгрузкой всё несохранённое должно попасть в хранилище
+        self.flush()
+        evicted = 0
+        for user_id in candidates:
+            if self.can_evict is not None and not self.can_evict(user_id):
+                continue
+            lock = self._locks.get(user_id)
+            if lock is not None and not lock.acquire(blocking=False):
+                continue
+            try:
+                with self._lock:
+                    state = self._states.get(user_id)
+                    if state is None or user_id in self._dirty or state._seen > now:
+                        continue
+                    del self._states[user_id]
+                    self._locks.pop(user_id, None)
+                    evicted += 1
+            finally:
+                if lock is not None:
+                    lock.release()
+        self.evicted += evicted
+        return evicted
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="state-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - self._last_evict >= max(self.flush_interval, 30):
+                    self._last_evict = time.monotonic()
+                    self.evict_idle()
+            except Exception:
+                logger.exception("Ошибка фоновой записи состояний")
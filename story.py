@@ -381,6 +381,33 @@ story = {
       "Джессика": "Подружиться с местными, поднимать всем настроение, немного наивная",
       "Люк": "Разряжает обстановку, шутник",
       "Шериф Донован": "Заманить приезжих ребят в город, втереться в доверие"
+    },
+    "fallbacks": {
+      "Майкл": [
+        "Алекс, держись за мной. Сначала выберемся отсюда, потом поговорим.",
+        "Тихо. Я проверю, что там, а ты побудь с ребятами.",
+        "Не сейчас, Алекс. Мне надо понять, как нам отсюда уехать."
+      ],
+      "Джессика": [
+        "Ой, Алекс, давай потом? Тут все такие милые, не хочу никого обидеть!",
+        "Ну не хмурься! Всё будет хорошо, вот увидишь.",
+        "Подожди секундочку, я только спрошу у местных…"
+      ],
+      "Люк": [
+        "Запиши вопрос, Алекс. Отвечу, когда нас тут никто не съест.",
+        "Секунду, я придумываю шутку, чтобы было не так жутко.",
+        "Всё под контролем! Ну… почти. Потом расскажу."
+      ],
+      "Шериф Донован": [
+        "Не беспокойтесь, мисс. В Эвансоне гостей не обижают.",
+        "Об этом потом. Сначала устроим вас как следует.",
+        "Вы устали с дороги. Вопросы подождут до утра."
+      ],
+      "Миссис Харпер": [
+        "Потом, деточка, потом. Сначала поешь, пирог стынет.",
+        "Не забивай себе голову. И не выходи из дома, когда туман.",
+        "Ох, некогда мне, дети. Располагайтесь, я скоро."
+      ]
     }
   }
 }
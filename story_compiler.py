@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import struct
+import sys
+
+# Формат файла эпизода:
+#   MAGIC
+#   uint32 длина заголовка, заголовок JSON: {"name", "goals", "fallbacks", "steps"}
+#   uint32 * (steps + 1) — таблица смещений шагов в блоке данных
+#   блок данных: компактный JSON каждого шага [text, delay, prompt_hint, [[name, line], ...]]
+MAGIC = b"HSTORY1\n"
+CATALOG = "catalog.json"
+DEFAULT_DELAY = 7
+
+
+def source_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def validate(story):
+    errors = []
+    for name, scene in story.items():
+        steps = scene.get("steps")
+        if not isinstance(steps, list) or not steps:
+            errors.append(f"{name}: нет шагов")
+            continue
+        for i, step in enumerate(steps):
+            where = f"{name}[{i}]"
+            if "text" not in step and not step.get("characters"):
+                errors.append(f"{where}: нет ни текста, ни реплик")
+            delay = step.get("delay", DEFAULT_DELAY)
+            if not isinstance(delay, (int, float)) or delay < 0:
+                errors.append(f"{where}: неверный delay {delay!r}")
+            for line in step.get("characters", []):
+                if not line.get("name") or not line.get("line"):
+                    errors.append(f"{where}: реплика без имени или текста")
+        if not isinstance(scene.get("goals", {}), dict):
+            errors.append(f"{name}: goals должен быть словарём")
+        fallbacks = scene.get("fallbacks", {})
+        if not isinstance(fallbacks, dict):
+            errors.append(f"{name}: fallbacks должен быть словарём")
+            continue
+        for character, lines in fallbacks.items():
+            if not isinstance(lines, list) or not lines or not all(isinstance(line, str) and line for line in lines):
+                errors.append(f"{name}: fallbacks[{character}] — нужен непустой список реплик")
+    if errors:
+        raise ValueError("Ошибки в истории:\n" + "\n".join(errors))
+
+
+def compile_step(step):
+    # Значения по умолчанию подставляются здесь, а не при каждом обращении
+    return [
+        step.get("text"),
+        step.get("delay", DEFAULT_DELAY),
+        step.get("prompt_hint") or None,
+        [[c["name"], c["line"]] for c in step.get("characters", [])],
+    ]
+
+
+def compile_episode(name, scene):
+    blobs = [
+        json.dumps(compile_step(step), ensure_ascii=False, separators=(",", ":")).encode()
+        for step in scene["steps"]
+    ]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    header = json.dumps(
+        {"name": name, "goals": scene.get("goals", {}), "fallbacks": scene.get("fallbacks", {}), "steps": len(blobs)},
+        ensure_ascii=False,
+    ).encode()
+    return b"".join([
+        MAGIC,
+        struct.pack("<I", len(header)),
+        header,
+        struct.pack(f"<{len(offsets)}I", *offsets),
+        *blobs,
+    ])
+
+
+def compile_story(story, out_dir, source=None):
+    validate(story)
+    os.makedirs(out_dir, exist_ok=True)
+    episodes = {}
+    for name, scene in story.items():
+        filename = f"{name}.ep"
+        _write(os.path.join(out_dir, filename), compile_episode(name, scene))
+        episodes[name] = filename
+    catalog = {"source_hash": source_hash(source) if source else None, "episodes": episodes}
+    # Каталог пишется последним: пока его нет, скомпилированная история считается неполной
+    _write(os.path.join(out_dir, CATALOG), json.dumps(catalog, ensure_ascii=False, indent=1).encode())
+    return catalog
+
+
+def _write(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    # python story_compiler.py [каталог] — проверить story.py и скомпилировать его
+    from story import story
+
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else "compiled_story"
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "story.py")
+    catalog = compile_story(story, out_dir, source)
+    print(f"Скомпилировано эпизодов: {len(catalog['episodes'])} -> {out_dir}")
@@ -0,0 +1,148 @@
+import bisect
+import threading
+
+from dialogue import estimate_tokens
+
+DEFAULT_PROMPT = """
+Ты — один из следующих персонажей: {names}.
+Алекс — главная героиня. Пользователь играет за неё и пишет от её имени.
+{goals}
+Контекст истории:
+{context}
+
+Ответь очень коротко и естественно от имени одного из этих персонажей. Не описывай действия. Не добавляй ничего лишнего. Не отвечай от имени Алекс. Формат:
+Имя: реплика
+"""
+
+# Реплики на случай, когда модель недоступна: персонаж сцены уходит от ответа,
+# а история продолжается по сценарию. Свои реплики персонажей задаются
+# в истории (fallbacks сцены), эти — для персонажей без них
+FALLBACK_LINES = (
+    "Тсс… Ты это слышала? Потом договорим.",
+    "Погоди, Алекс, не сейчас. Что-то тут не так.",
+    "Давай позже, ладно? Мне надо подумать.",
+    "Хм… Сейчас не время. Держись рядом.",
+    "Я тебя слышу, Алекс. Просто дай мне минуту.",
+)
+
+
+class SceneIndex:
+    # Индекс сцены, который строится один раз при загрузке истории:
+    # весь транскрипт одной строкой и смещения конца контекста для каждого шага,
+    # списки имён персонажей и готовые системные промпты (собираются лениво).
+    # В промпт попадает только хвост контекста, укладывающийся в context_budget
+    # токенов, поэтому размер промпта не растёт к концу эпизода.
+    def __init__(self, scene, context_budget=600):
+        self.scene = scene
+        self.size = len(scene.steps)
+        self.goals = scene.goals
+        self.fallbacks = scene.fallbacks
+        self.context_budget = context_budget
+
+        lines = []
+        self.offsets = []
+        self.line_counts = []
+        self.line_starts = []
+        self.token_sums = [0]
+        self.names = []
+        pos = 0
+        for step in scene.steps:
+            self.offsets.append(pos)
+            self.line_counts.append(len(lines))
+            self.names.append([c.name for c in step.characters])
+            for c in step.characters:
+                line = f"{c.name}: {c.line}"
+                if lines:
+                    pos += 1
+                self.line_starts.append(pos)
+                self.token_sums.append(self.token_sums[-1] + estimate_tokens(line) + 1)
+                pos += len(line)
+                lines.append(line)
+        self.offsets.append(pos)
+        self.line_counts.append(len(lines))
+        self.transcript = "\n".join(lines)
+        self.prompts = [None] * self.size
+
+    def is_valid_for(self, scene):
+        return self.scene is scene and self.size == len(scene.steps)
+
+    def context(self, step_index):
+        # Контекст — всё, что персонажи сказали до этого шага
+        return self.transcript[:self.offsets[step_index]]
+
+    def context_window(self, step_index):
+        # Последние реплики до шага, суммарно не больше context_budget токенов
+        end = self.line_counts[step_index]
+        start = bisect.bisect_left(self.token_sums, self.token_sums[end] - self.context_budget, 0, end)
+        if start >= end:
+            return ""
+        return self.transcript[self.line_starts[start]:self.offsets[step_index]]
+
+    def goals_text(self, step_index):
+        goals = [f"{name}: {self.goals[name]}" for name in self.names[step_index] if name in self.goals]
+        if not goals:
+            return ""
+        return "\nЦели персонажей:\n" + "\n".join(goals) + "\n"
+
+    def speakers(self, step_index):
+        # Кто может ответить игроку на этом шаге: персонажи шага с целями в сцене,
+        # иначе любые персонажи шага или последние говорившие до него
+        for i in range(min(step_index, self.size - 1), -1, -1):
+            names = list(dict.fromkeys(self.names[i]))
+            if names:
+                main = [name for name in names if name in self.goals]
+                return main or names
+        return list(self.goals)
+
+    def fallback(self, step_index, seed=0):
+        speakers = self.speakers(step_index)
+        if not speakers:
+            return FALLBACK_LINES[seed % len(FALLBACK_LINES)]
+        name = speakers[seed % len(speakers)]
+        lines = self.fallbacks.get(name) or FALLBACK_LINES
+        return f"{name}: {lines[seed // len(speakers) % len(lines)]}"
+
+    def prompt(self, step_index):
+        prompt = self.prompts[step_index]
+        if prompt is None:
+            step = self.scene.steps[step_index]
+            # Используем кастомный промпт, если есть
+            if step.prompt_hint:
+                prompt = step.prompt_hint + self.goals_text(step_index)
+            else:
+                prompt = DEFAULT_PROMPT.format(
+                    names=", ".join(self.names[step_index]),
+                    goals=self.goals_text(step_index),
+                    context=self.context_window(step_index),
+                )
+            self.prompts[step_index] = prompt
+        return prompt
+
+
+class StoryIndex:
+    # Индексы всех сцен истории. Индекс сцены пересобирается, если сама сцена
+    # была заменена (например, история перезагружена после перекомпиляции)
+    # или изменилось число шагов; в остальных случаях — invalidate().
+    def __init__(self, story, context_budget=600):
+        self.story = story
+        self.context_budget = context_budget
+        self._scenes = {}
+        self._lock = threading.Lock()
+
+    def scene(self, name):
+        scene = self.story[name]
+        index = self._scenes.get(name)
+        if index is None or not index.is_valid_for(scene):
+            with self._lock:
+                index = self._scenes.get(name)
+                if index is None or not index.is_valid_for(scene):
+                    index = SceneIndex(scene, self.context_budget)
+                    self._scenes[name] = index
+        return index
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._scenes.clear()
+            else:
+                self._scenes.pop(name, None)
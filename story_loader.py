@@ -0,0 +1,128 @@
+import json
+import os
+import struct
+import threading
+
+from story_compiler import CATALOG, MAGIC, compile_story, source_hash
+
+
+class Line:
+    __slots__ = ("name", "line")
+
+    def __init__(self, name, line):
+        self.name = name
+        self.line = line
+
+
+class Step:
+    __slots__ = ("text", "delay", "prompt_hint", "characters")
+
+    def __init__(self, text, delay, prompt_hint, characters):
+        self.text = text
+        self.delay = delay
+        self.prompt_hint = prompt_hint
+        self.characters = tuple(Line(name, line) for name, line in characters)
+
+
+class Steps:
+    # Шаги эпизода разбираются из блока данных по таблице смещений
+    # при первом обращении к конкретному шагу
+    __slots__ = ("_data", "_base", "_offsets", "_steps")
+
+    def __init__(self, data, base, offsets):
+        self._data = data
+        self._base = base
+        self._offsets = offsets
+        self._steps = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self._steps)
+
+    def __getitem__(self, i):
+        step = self._steps[i]
+        if step is None:
+            if i < 0:
+                i += len(self._steps)
+            raw = self._data[self._base + self._offsets[i]:self._base + self._offsets[i + 1]]
+            step = self._steps[i] = Step(*json.loads(raw))
+        return step
+
+    def __iter__(self):
+        for i in range(len(self._steps)):
+            yield self[i]
+
+
+class Scene:
+    __slots__ = ("name", "goals", "steps", "fallbacks")
+
+    def __init__(self, name, goals, steps, fallbacks=None):
+        self.name = name
+        self.goals = goals
+        self.steps = steps
+        self.fallbacks = fallbacks or {}
+
+
+def read_episode(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path}: неизвестный формат эпизода")
+    pos = len(MAGIC)
+    (header_len,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    header = json.loads(data[pos:pos + header_len])
+    pos += header_len
+    count = header["steps"] + 1
+    offsets = struct.unpack_from(f"<{count}I", data, pos)
+    pos += 4 * count
+    return Scene(header["name"], header["goals"], Steps(data, pos, offsets), header.get("fallbacks"))
+
+
+class Story:
+    # Скомпилированная история: эпизоды читаются с диска при первом обращении,
+    # поэтому память и время старта зависят только от используемых эпизодов
+    def __init__(self, compiled_dir, catalog):
+        self.compiled_dir = compiled_dir
+        self.episodes = catalog["episodes"]
+        self._scenes = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        scene = self._scenes.get(name)
+        if scene is None:
+            with self._lock:
+                scene = self._scenes.get(name)
+                if scene is None:
+                    scene = read_episode(os.path.join(self.compiled_dir, self.episodes[name]))
+                    self._scenes[name] = scene
+        return scene
+
+    def __contains__(self, name):
+        return name in self.episodes
+
+    def __iter__(self):
+        return iter(self.episodes)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def loaded(self):
+        return list(self._scenes)
+
+
+def load_story(compiled_dir, source=None):
+    # Если скомпилированной истории нет или story.py изменился —
+    # перекомпилируем её перед загрузкой
+    catalog = None
+    catalog_path = os.path.join(compiled_dir, CATALOG)
+    if os.path.exists(catalog_path):
+        with open(catalog_path, encoding="utf-8") as f:
+            catalog = json.load(f)
+    if source and os.path.exists(source):
+        if catalog is None or catalog.get("source_hash") != source_hash(source):
+            from story import story
+
+            catalog = compile_story(story, compiled_dir, source)
+    if catalog is None:
+        raise FileNotFoundError(f"Нет скомпилированной истории в {compiled_dir}")
+    return Story(compiled_dir, catalog)
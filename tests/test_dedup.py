@@ -0,0 +1,36 @@
+import time
+
+from dedup import RecentKeys
+
+
+def test_repeat_within_window_is_duplicate():
+    keys = RecentKeys(window=60)
+    assert not keys.seen(1)
+    assert keys.seen(1)
+    assert not keys.seen(2)
+    assert keys.duplicates == 1
+
+
+def test_keys_expire_after_window():
+    keys = RecentKeys(window=0.02)
+    keys.seen(1)
+    time.sleep(0.03)
+    assert not keys.seen(1)
+    assert len(keys) == 1
+
+
+def test_size_is_bounded():
+    keys = RecentKeys(window=60, max_size=3)
+    for key in range(5):
+        keys.seen(key)
+    assert len(keys) == 3
+    # Самые старые ключи вытеснены
+    assert not keys.seen(0)
+
+
+def test_forget():
+    keys = RecentKeys(window=60)
+    keys.seen(1)
+    keys.forget(1)
+    keys.forget(2)
+    assert not keys.seen(1)
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+from dialogue import DialogueMemory
+
+
+def make_state():
+    return SimpleNamespace(history=[], summary="")
+
+
+def test_old_turns_fold_into_summary():
+    memory = DialogueMemory(token_budget=1000, max_turns=2, summary_budget=100)
+    state = make_state()
+    for text in ("кто там?", "Майкл: не знаю", "пойдём отсюда"):
+        memory.add(state, "user" if "Майкл" not in text else "assistant", text)
+    assert [text for _, text in state.history] == ["Майкл: не знаю", "пойдём отсюда"]
+    assert state.summary == "Алекс: кто там?"
+
+
+def test_remembers_only_players_with_dialogue():
+    memory = DialogueMemory()
+    state = make_state()
+    assert not memory.remembers(None)
+    assert not memory.remembers(state)
+    memory.add(state, "user", "кто там?")
+    assert memory.remembers(state)
+    assert memory.remembers(SimpleNamespace(history=[], summary="Алекс: кто там?"))
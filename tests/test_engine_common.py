@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from dialogue import DialogueMemory
+from engine_common import PendingInputs, check_admin, reply_context
+
+
+def test_window_slides_until_max_wait():
+    inputs = PendingInputs(window=1.5, max_wait=4)
+    assert inputs.add(1, "кто там?", now=0) == 1.5
+    assert inputs.add(1, "эй", now=1) == 1.5
+    assert inputs.add(1, "ответь", now=3) == 1
+    assert 1 in inputs and len(inputs) == 1
+
+
+def test_delivered_batch_keeps_newer_inputs():
+    inputs = PendingInputs(window=1.5, max_wait=4)
+    inputs.add(1, "кто там?", now=0)
+    inputs.add(1, "эй", now=0.5)
+    batch = inputs.take(1)
+    inputs.add(1, "ответь", now=1)
+
+    assert batch.superseded()
+    inputs.done(1, batch, delivered=True)
+    assert inputs.stats["merged"] == 1
+    assert inputs.take(1).texts == ["ответь"]
+
+
+def test_superseded_batch_is_answered_later():
+    inputs = PendingInputs(window=1.5, max_wait=4)
+    inputs.add(1, "кто там?", now=0)
+    batch = inputs.take(1)
+    inputs.add(1, "эй", now=1)
+    inputs.done(1, batch, delivered=False)
+    assert inputs.stats["superseded"] == 1
+    assert inputs.take(1).texts == ["кто там?", "эй"]
+
+
+def test_undelivered_batch_is_dropped():
+    inputs = PendingInputs(window=1.5, max_wait=4)
+    inputs.add(1, "кто там?", now=0)
+    inputs.done(1, inputs.take(1), delivered=False)
+    assert 1 not in inputs
+    assert inputs.take(1) is None
+
+
+def test_check_admin():
+    assert check_admin("secret", "") == (404, "not found")
+    assert check_admin(None, "secret") == (403, "forbidden")
+    assert check_admin("wrong", "secret") == (403, "forbidden")
+    assert check_admin("secret", "secret") is None
+
+
+def test_short_inputs_skip_dialogue_memory():
+    memory = DialogueMemory()
+    state = SimpleNamespace(history=[["user", "кто там?"]], summary="")
+    assert reply_context(memory, state, "Окей!!", short_tokens=6) == (True, None)
+    long_input = "я не понимаю, что происходит и где мы вообще находимся"
+    assert reply_context(memory, state, long_input, short_tokens=6) == (False, state)
+    fresh = SimpleNamespace(history=[], summary="")
+    assert reply_context(memory, fresh, long_input, short_tokens=6) == (True, fresh)
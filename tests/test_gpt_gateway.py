@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+from gpt_gateway import AsyncModelGateway, CircuitBreaker, CircuitOpen, GatewayBusy, ModelGateway
+
+
+class Flaky:
+    # create(...) для шлюза: сначала fail_times ошибок, затем ответ
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.calls = 0
+
+    def __call__(self, timeout=None, stream=False, **kwargs):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise RuntimeError("model error")
+        return iter(["Май", "кл"]) if stream else "ok"
+
+
+def open_breaker(create, gateway_class=ModelGateway):
+    # Одна ошибка размыкает цепь, и она почти сразу переходит в half_open
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    gateway = gateway_class(create, max_concurrency=1, wait_timeout=0.1, retries=0, breaker=breaker)
+    return gateway, breaker
+
+
+def test_breaker_opens_and_recovers():
+    gateway, breaker = open_breaker(Flaky(fail_times=1))
+    with pytest.raises(RuntimeError):
+        gateway.call(messages=[])
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        gateway.call(messages=[])
+
+    time.sleep(0.06)
+    assert gateway.call(messages=[]) == "ok"
+    assert breaker.state == "closed"
+    assert gateway.counts["open"] == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+def test_stream_closed_early_releases_probe():
+    gateway, breaker = open_breaker(Flaky(fail_times=1))
+    with pytest.raises(RuntimeError):
+        gateway.call(messages=[])
+    time.sleep(0.06)
+
+    # Пробный запрос — поток, который закрыли, не дочитав
+    stream = gateway.call(messages=[], stream=True)
+    next(stream)
+    stream.close()
+
+    assert breaker.state == "half_open"
+    assert gateway.call(messages=[]) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_stream_holds_slot_until_finished():
+    gateway = ModelGateway(Flaky(), max_concurrency=1, wait_timeout=0.05)
+    stream = gateway.call(messages=[], stream=True)
+    assert "".join(stream) == "Майкл"
+    assert gateway.call(messages=[]) == "ok"
+
+
+def test_async_stream_closed_early_releases_probe():
+    class Chunks:
+        def __init__(self):
+            self.parts = iter(["Май", "кл"])
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return next(self.parts)
+            except StopIteration:
+                raise StopAsyncIteration from None
+
+    create = Flaky(fail_times=1)
+
+    async def acreate(**kwargs):
+        result = create(**kwargs)
+        return Chunks() if kwargs.get("stream") else result
+
+    async def scenario():
+        gateway, breaker = open_breaker(acreate, AsyncModelGateway)
+        with pytest.raises(RuntimeError):
+            await gateway.call(messages=[])
+        await asyncio.sleep(0.06)
+
+        stream = await gateway.call(messages=[], stream=True)
+        await stream.__anext__()
+        await stream.aclose()
+
+        assert breaker.state == "half_open"
+        assert await gateway.call(messages=[]) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_transient_errors_are_retried():
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs["timeout"])
+        if len(calls) < 3:
+            raise TimeoutError()
+        return "ok"
+
+    gateway = ModelGateway(create, retries=2, backoff=0.001, call_timeout=1.0)
+    assert gateway.call(messages=[]) == "ok"
+    assert calls == [1.0, 1.0, 1.0]
+    assert gateway.counts["retried"] == 2 and gateway.counts["ok"] == 1
+
+
+def test_retries_stop_after_limit():
+    def create(**kwargs):
+        raise TimeoutError()
+
+    breaker = CircuitBreaker(failure_threshold=5)
+    gateway = ModelGateway(create, retries=1, backoff=0.001, breaker=breaker)
+    with pytest.raises(TimeoutError):
+        gateway.call(messages=[])
+    assert gateway.counts["error"] == 1
+    assert breaker.failures == 1
+
+
+def test_no_free_slot_raises_busy():
+    gateway, breaker = open_breaker(Flaky())
+    stream = gateway.call(messages=[], stream=True)
+    with pytest.raises(GatewayBusy):
+        gateway.call(messages=[])
+    assert gateway.counts["busy"] == 1
+    stream.close()
+    assert gateway.call(messages=[]) == "ok"
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from playback import MESSAGE_LIMIT, escape_markdown, next_block, next_line
+from story_loader import Step
+
+
+def make_state(step=0):
+    return SimpleNamespace(step=step, line_index=0, narrated=False, step_completed=False)
+
+
+STEPS = [
+    Step("Машина заглохла.", 7, None, [["Майкл", "Отлично."], ["Люк", "Палатка есть!"]]),
+    Step(None, 3, None, [["Джессика", "Комары."]]),
+]
+
+
+def play(state, steps, fn):
+    events = []
+    while True:
+        event = fn(state, steps)
+        events.append(event)
+        if event is None and state.step >= len(steps):
+            return events
+
+
+def test_next_line_plays_step_line_by_line():
+    state = make_state()
+    assert next_line(state, STEPS) == ("_Машина заглохла._", "Markdown", 7)
+    assert next_line(state, STEPS) == ("Майкл: Отлично.", None, 7)
+    assert next_line(state, STEPS) == ("Люк: Палатка есть!", None, 7)
+    assert next_line(state, STEPS) is None
+    assert (state.step, state.line_index, state.narrated, state.step_completed) == (1, 0, False, True)
+
+
+def test_next_line_after_last_step():
+    state = make_state(step=2)
+    assert next_line(state, STEPS) is None
+    assert state.step_completed and state.step == 2
+
+
+def test_next_block_sends_rest_of_step_at_once():
+    state = make_state()
+    state.narrated = True
+    text, parse_mode, pause = next_block(state, STEPS)
+    assert text == "*Майкл:* Отлично\\.\n\n*Люк:* Палатка есть\\!"
+    assert parse_mode == "MarkdownV2"
+    # Пауза — как у двух отдельных строк
+    assert pause == 14
+    assert next_block(state, STEPS) is None
+    assert state.step == 1
+
+
+def test_next_block_and_next_line_reach_same_state():
+    by_line, by_block = make_state(), make_state()
+    play(by_line, STEPS, next_line)
+    play(by_block, STEPS, next_block)
+    assert vars(by_line) == vars(by_block)
+
+
+def test_long_step_falls_back_to_lines():
+    steps = [Step(None, 1, None, [["Майкл", "а" * MESSAGE_LIMIT]])]
+    state = make_state()
+    assert next_block(state, steps) == (f"Майкл: {'а' * MESSAGE_LIMIT}", None, 1)
+
+
+def test_escape_markdown():
+    assert escape_markdown("Эй! (тише) _a_ 1.5") == "Эй\\! \\(тише\\) \\_a\\_ 1\\.5"
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+from bot_api_stub import BotApiStub, StubRequest
+from polling import Checkpoint, Poller
+
+
+class App:
+    # Вместо main.py: enqueue_update запоминает апдейты; пока finish=False,
+    # они остаются «в работе» у воркеров
+    def __init__(self, stub, finish=True):
+        self.bot = SimpleNamespace(base_url="http://stub/bot123:TEST", request=StubRequest(stub))
+        self.finish = finish
+        self.handled = []
+
+    def enqueue_update(self, data, done=None):
+        self.handled.append(data["update_id"])
+        if self.finish and done is not None:
+            done()
+        return True
+
+
+def message(text):
+    return {"message": {"message_id": 1, "chat": {"id": 1, "type": "private"}, "text": text}}
+
+
+def test_offset_confirms_batch():
+    stub = BotApiStub()
+    for text in ("кто там?", "ок", "бежим"):
+        stub.add_update(message(text))
+    app = App(stub)
+    poller = Poller(app, batch=2)
+
+    assert poller.poll_once() == 2
+    assert poller.timeout == 0
+    assert poller.poll_once() == 1
+    assert app.handled == [1, 2, 3]
+    assert poller.checkpoint.offset == 4
+
+    # Пустой ответ: следующий getUpdates подтверждает пачку и ждёт дольше
+    assert poller.poll_once() == 0
+    assert stub.calls[-1] == ("getUpdates", {"offset": 4, "limit": 2, "timeout": 1})
+    assert stub.updates == []
+    assert poller.timeout == 2
+
+
+def test_resume_after_restart(tmp_path):
+    path = str(tmp_path / "offset.json")
+    stub = BotApiStub()
+    for text in ("кто там?", "ок"):
+        stub.add_update(message(text))
+
+    # Апдейты приняты, но не обработаны; перед следующим getUpdates они записаны
+    poller = Poller(App(stub, finish=False), checkpoint_path=path)
+    poller.poll_once()
+    poller.poll_once()
+    assert stub.updates == []
+
+    restarted = App(stub)
+    poller = Poller(restarted, checkpoint_path=path)
+    assert poller.checkpoint.offset == 3
+    poller.resume()
+    assert restarted.handled == [1, 2]
+    assert len(poller.checkpoint) == 0
+
+    stub.add_update(message("бежим"))
+    poller.poll_once()
+    assert restarted.handled == [1, 2, 3]
+
+
+def test_checkpoint_skips_unchanged_save(tmp_path):
+    path = tmp_path / "offset.json"
+    checkpoint = Checkpoint(str(path))
+    checkpoint.accept({"update_id": 7})
+    checkpoint.save()
+    saved = path.stat().st_mtime_ns
+    checkpoint.save()
+    assert path.stat().st_mtime_ns == saved
+
+    checkpoint.finish(7)
+    checkpoint.save()
+    assert Checkpoint(str(path)).pending == {}
+    assert Checkpoint(str(path)).offset == 8
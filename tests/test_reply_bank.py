@@ -0,0 +1,51 @@
+import pytest
+
+from reply_bank import IntentMatcher, ReplyBank
+
+
+@pytest.fixture(scope="module")
+def bank():
+    replies = {"ep": {"0": {intent: [f"ответ {intent}"] for intent in (
+        "who", "leave", "scared", "what", "where", "help", "agree", "refuse", "greet",
+    )}}}
+    return ReplyBank({"replies": replies})
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Кто это??", "who"),
+    ("пойдем отсюда", "leave"),
+    ("валим", "leave"),
+    ("мне очень страшно", "scared"),
+    ("что случилось?", "what"),
+    ("ты где", "where"),
+    ("помогите!", "help"),
+    ("окей", "agree"),
+    ("я не пойду", "refuse"),
+    ("привет всем", "greet"),
+])
+def test_common_phrases_hit_the_bank(bank, text, intent):
+    assert bank.get("ep", 0, text) == f"ответ {intent}"
+
+
+@pytest.mark.parametrize("text", [
+    "давай позвоним маме",
+    "страшно интересно",
+    "нет слов",
+    "привет передай маме",
+    "что за бред",
+    "давай ещё поговорим",
+    "где-то я это видела",
+    "ладно, а что дальше будет с шерифом?",
+])
+def test_lookalike_phrases_go_to_the_model(bank, text):
+    assert bank.get("ep", 0, text) is None
+
+
+def test_ambiguous_phrase_has_no_intent():
+    matcher = IntentMatcher({"a": ["кто там"], "b": ["кто тут"]})
+    assert matcher.match("кто там тут") == (None, 0.0)
+
+
+def test_unknown_step_misses(bank):
+    assert bank.get("ep", 5, "кто там?") is None
+    assert bank.stats()["misses"] >= 1
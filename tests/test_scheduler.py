@@ -0,0 +1,101 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from scheduler import AsyncScheduler, Scheduler
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(workers=2)
+    scheduler.start()
+    return scheduler
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_events_fire_in_due_order(scheduler):
+    fired = []
+    scheduler.schedule("b", 0.06, fired.append, "b")
+    scheduler.schedule("a", 0.02, fired.append, "a")
+    assert wait_for(lambda: len(fired) == 2)
+    assert fired == ["a", "b"]
+    assert scheduler.pending() == 0
+
+
+def test_reschedule_replaces_pending_event(scheduler):
+    fired = []
+    scheduler.schedule((1, "playback"), 0.02, fired.append, "old")
+    scheduler.schedule((1, "playback"), 0.04, fired.append, "new")
+    assert scheduler.pending() == 1
+    assert wait_for(lambda: fired)
+    time.sleep(0.05)
+    assert fired == ["new"]
+
+
+def test_cancel(scheduler):
+    fired = []
+    scheduler.schedule("k", 0.02, fired.append, 1)
+    assert scheduler.is_scheduled("k")
+    assert scheduler.cancel("k")
+    assert not scheduler.cancel("k")
+    time.sleep(0.05)
+    assert fired == []
+
+
+def test_event_runs_with_scheduling_context(scheduler):
+    seen = []
+    done = threading.Event()
+
+    def fire():
+        seen.append(request_id.get())
+        done.set()
+
+    request_id.set(42)
+    scheduler.schedule("ctx", 0, fire)
+    request_id.set(None)
+    assert done.wait(2)
+    assert seen == [42]
+
+
+def test_failing_event_does_not_stop_timer(scheduler):
+    fired = []
+
+    def boom():
+        raise RuntimeError("boom")
+
+    scheduler.schedule("bad", 0, boom)
+    scheduler.schedule("good", 0.02, fired.append, 1)
+    assert wait_for(lambda: fired == [1])
+
+
+def test_async_scheduler_replace_and_cancel():
+    async def scenario():
+        scheduler = AsyncScheduler()
+        scheduler.start()
+        fired = []
+
+        async def fire(value):
+            fired.append(value)
+
+        scheduler.schedule("k", 0.01, fire, "old")
+        scheduler.schedule("k", 0.02, fire, "new")
+        scheduler.schedule("c", 0.01, fire, "cancelled")
+        assert scheduler.cancel("c")
+        assert scheduler.pending() == 1
+        await asyncio.sleep(0.05)
+        return fired, scheduler.pending()
+
+    assert asyncio.run(scenario()) == (["new"], 0)
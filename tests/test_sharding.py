@@ -0,0 +1,93 @@
+import multiprocessing
+from collections import Counter
+
+import pytest
+
+from sharding import Front, HashRing, prepare_worker_env, update_chat_id
+
+
+def test_node_for_is_stable():
+    ring = HashRing(["w0", "w1", "w2"])
+    again = HashRing(["w2", "w0", "w1"])
+    assert all(ring.node_for(chat) == again.node_for(chat) for chat in range(1000))
+
+
+def test_chats_spread_over_nodes():
+    ring = HashRing(["w0", "w1", "w2", "w3"])
+    counts = Counter(ring.node_for(chat) for chat in range(10000))
+    assert set(counts) == {"w0", "w1", "w2", "w3"}
+    assert min(counts.values()) > 1500
+
+
+def test_adding_node_moves_few_chats():
+    ring = HashRing(["w0", "w1", "w2", "w3"])
+    before = {chat: ring.node_for(chat) for chat in range(10000)}
+    ring.add("w4")
+    moved = [chat for chat, node in before.items() if ring.node_for(chat) != node]
+    # Переезжают только чаты нового узла, примерно 1/5
+    assert all(ring.node_for(chat) == "w4" for chat in moved)
+    assert 1000 < len(moved) < 3000
+
+    ring.remove("w4")
+    assert all(ring.node_for(chat) == node for chat, node in before.items())
+
+
+def test_empty_ring():
+    with pytest.raises(LookupError):
+        HashRing().node_for(1)
+
+
+def test_update_chat_id():
+    assert update_chat_id({"update_id": 1, "message": {"chat": {"id": 5}}}) == 5
+    assert update_chat_id({"callback_query": {"message": {"chat": {"id": 7}}}}) == 7
+    assert update_chat_id({"update_id": 2, "poll": {}}) is None
+
+
+def worker_settings(results):
+    # Как worker_main: процесс, запущенный через spawn, импортирует main
+    import main
+
+    results.put((main.STATE_SNAPSHOT_PATH, main.OUTBOX_GLOBAL_RATE))
+
+
+def test_spawned_worker_has_no_snapshot(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "123456:TEST")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("STATE_BACKEND", "memory")
+    monkeypatch.setenv("STATE_SNAPSHOT_PATH", "user_states.db.snapshot")
+    monkeypatch.setenv("OUTBOX_GLOBAL_RATE", "30")
+    prepare_worker_env(3)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=worker_settings, args=(results,))
+    process.start()
+    try:
+        snapshot_path, global_rate = results.get(timeout=60)
+    finally:
+        process.join(10)
+    assert snapshot_path == ""
+    assert global_rate == 10
+
+
+def test_removed_worker_queue_is_rerouted():
+    front = Front(workers=3, queue_size=100)
+    updates = [{"update_id": chat, "message": {"chat": {"id": chat}}} for chat in range(60)]
+    for data in updates:
+        assert front.route(data)
+    stuck = front.queues["worker-0"].qsize()
+    assert stuck > 0
+
+    front.remove("worker-0")
+    assert set(front.queues) == {"worker-1", "worker-2"}
+    assert set(front.queue_sizes()) == {"worker-1", "worker-2"}
+    assert sum(front.queue_sizes().values()) == len(updates)
+
+    # Апдейты каждого чата лежат в очереди воркера, к которому он теперь относится
+    chats = []
+    for name, inbox in front.queues.items():
+        for _ in range(inbox.qsize()):
+            data = inbox.get(timeout=1)
+            assert front.ring.node_for(data["message"]["chat"]["id"]) == name
+            chats.append(data["message"]["chat"]["id"])
+    assert sorted(chats) == list(range(60))
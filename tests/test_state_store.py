@@ -0,0 +1,100 @@
+import json
+
+from state_store import MemoryStateStore, UserStates
+
+
+def make_states(**kwargs):
+    return UserStates(MemoryStateStore(), transient={"step_completed": True}, **kwargs)
+
+
+def test_snapshot_restore_roundtrip(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    states = make_states()
+    states.get(1).step = 5
+    states.get(1).step_completed = False
+    states.flush()
+    assert states.snapshot(path) == 1
+
+    fresh = make_states()
+    restored = fresh.restore(path)
+    assert [state.step for state in restored] == [5]
+    # transient-поля после рестарта получают заданные значения
+    assert fresh.get(1).step_completed is True
+    assert not (tmp_path / "snapshot.json").exists()
+
+
+def test_corrupt_snapshot_falls_back_to_store(tmp_path):
+    path = tmp_path / "snapshot.json"
+    path.write_text('{"1": {"step": 5', encoding="utf-8")
+    states = make_states()
+    assert states.restore(str(path)) == []
+    assert not path.exists()
+    assert states.get(1).step == 0
+
+
+def test_snapshot_skips_broken_entries(tmp_path):
+    path = tmp_path / "snapshot.json"
+    path.write_text(json.dumps({"1": {"step": 3}, "x": {"step": 4}, "2": [1]}), encoding="utf-8")
+    states = make_states()
+    assert [state.step for state in states.restore(str(path))] == [3]
+
+
+def test_flush_writes_only_dirty_states():
+    store = MemoryStateStore()
+    states = UserStates(store)
+    states.get(1).step = 2
+    states.get(2)
+    assert states.flush() == 1
+    assert store.load(1)["step"] == 2
+    assert store.load(2) is None
+    assert states.flush() == 0
+
+
+def test_failed_flush_keeps_changes():
+    class FlakyStore(MemoryStateStore):
+        fail = True
+
+        def save_many(self, items):
+            if self.fail:
+                self.fail = False
+                raise OSError("disk full")
+            super().save_many(items)
+
+    store = FlakyStore()
+    states = UserStates(store)
+    states.get(1).step = 3
+    states.flush()
+    assert store.load(1) is None
+    assert states.flush() == 1
+    assert store.load(1)["step"] == 3
+
+
+def test_idle_chats_are_evicted_and_reloaded():
+    store = MemoryStateStore()
+    states = UserStates(store, transient={"step_completed": True}, idle_ttl=0)
+    states.get(1).step = 4
+    states.get(1).step_completed = False
+    states.lock(1)
+    assert states.evict_idle() == 1
+    assert 1 not in states and states.evicted == 1
+
+    state = states.get(1)
+    assert state.step == 4
+    assert state.step_completed is True
+
+
+def test_eviction_respects_max_active_and_can_evict():
+    states = UserStates(MemoryStateStore(), max_active=2, can_evict=lambda user_id: user_id != 1)
+    for user_id in (1, 2, 3, 4):
+        states.get(user_id)
+    # Переполнение — два самых давних чата, но чат 1 выгружать нельзя
+    assert states.evict_idle() == 1
+    assert 1 in states and 2 not in states and len(states) == 3
+
+
+def test_busy_chat_is_not_evicted():
+    states = UserStates(MemoryStateStore(), idle_ttl=0)
+    states.get(1)
+    with states.lock(1):
+        assert states.evict_idle() == 0
+    assert 1 in states
@@ -0,0 +1,22 @@
+from story_index import FALLBACK_LINES, SceneIndex
+from story_loader import Scene, Step
+
+
+def make_scene(fallbacks=None):
+    steps = [
+        Step("Дорога.", 7, None, [["Майкл", "Приехали."]]),
+        Step(None, 7, None, [["Миссис Харпер", "Проходите, дети."]]),
+    ]
+    return Scene("ep", {"Майкл": "лидер группы"}, steps, fallbacks)
+
+
+def test_fallback_uses_character_pool():
+    index = SceneIndex(make_scene({"Майкл": ["Держись за мной.", "Не сейчас."]}))
+    assert {index.fallback(0, seed) for seed in range(4)} == {"Майкл: Держись за мной.", "Майкл: Не сейчас."}
+
+
+def test_fallback_without_pool_uses_generic_lines():
+    index = SceneIndex(make_scene({"Майкл": ["Держись за мной."]}))
+    name, line = index.fallback(1, seed=3).split(": ", 1)
+    assert name == "Миссис Харпер"
+    assert line in FALLBACK_LINES
@@ -0,0 +1,77 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Лёгкая трассировка апдейтов: этапы обработки (вебхук, диспетчер, ожидание
+# лока чата, сборка промпта, OpenAI, отправка в Telegram) записываются
+# спанами с update_id и chat_id в кольцевой буфер в памяти.
+#
+# Текущий апдейт хранится в contextvars: в asyncio он переходит в задачи
+# и таймеры сам, Scheduler копирует контекст при планировании события,
+# а Outbox запоминает его в момент постановки сообщения в очередь.
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Tracer:
+    def __init__(self, capacity=10000):
+        self.enabled = capacity > 0
+        self.spans = deque(maxlen=max(1, capacity))
+        self.recorded = 0
+
+    def current(self):
+        # {"update_id": ..., "chat_id": ...} обрабатываемого апдейта или None
+        return _current.get()
+
+    @contextmanager
+    def bind(self, update_id=None, chat_id=None):
+        token = _current.set({"update_id": update_id, "chat_id": chat_id})
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled:
+            yield
+            return
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, started, time.perf_counter() - t0, **attrs)
+
+    def record(self, name, started, seconds, trace=None, **attrs):
+        # started — time.time() начала этапа; trace — контекст, если этап
+        # выполняется не там, где был принят апдейт (например, в Outbox)
+        if not self.enabled:
+            return
+        trace = trace or _current.get() or {}
+        span = {
+            "name": name,
+            "update_id": trace.get("update_id"),
+            "chat_id": trace.get("chat_id"),
+            "start": round(started, 6),
+            "ms": round(seconds * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        span.update((k, v) for k, v in attrs.items() if v is not None)
+        # append у deque атомарен, отдельный лок не нужен
+        self.spans.append(span)
+        self.recorded += 1
+
+    def export(self, update_id=None, chat_id=None, limit=1000):
+        # Спаны от старых к новым, при необходимости только одного апдейта или чата
+        spans = list(self.spans)
+        if update_id is not None:
+            spans = [s for s in spans if s["update_id"] == update_id]
+        if chat_id is not None:
+            spans = [s for s in spans if s["chat_id"] == chat_id]
+        return spans[-limit:] if limit else spans
@@ -0,0 +1,131 @@
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Запись реального трафика для повторного прогона (replay.py).
+# Формат — JSON Lines, одна строка на доставку вебхука: {"t": время прихода, "u": апдейт}.
+# Файл только дописывается; запись идёт в фоновом потоке, вебхук лишь кладёт
+# апдейт в очередь.
+#
+# Анонимизация: chat_id и id пользователей заменяются на HMAC от соли
+# (одинаковые чаты остаются одинаковыми внутри записи), имена заменяются
+# на «Игрок», юзернеймы, контакты и геопозиция удаляются. Текст сообщений
+# по умолчанию маскируется с сохранением длины и алфавита; команды
+# сохраняются как есть.
+
+_ID_FIELDS = ("id", "user_id", "chat_id")
+_DROP_FIELDS = ("last_name", "username", "title", "bio", "phone_number",
+                "contact", "location", "venue", "photo", "invite_link", "description")
+_CYRILLIC = re.compile(r"[а-яё]", re.IGNORECASE)
+_LATIN = re.compile(r"[a-z]", re.IGNORECASE)
+_DIGIT = re.compile(r"\d")
+
+
+def mask_text(text):
+    # "Кто там, Майк?" -> "ааа ааа, аааа?": длина, пробелы и пунктуация те же
+    if text.startswith("/"):
+        command, _, rest = text.partition(" ")
+        return command + (" " + mask_text(rest) if rest else "")
+    text = _CYRILLIC.sub("а", text)
+    text = _LATIN.sub("a", text)
+    return _DIGIT.sub("0", text)
+
+
+class Anonymizer:
+    def __init__(self, salt, keep_text=False):
+        self.salt = salt.encode() if isinstance(salt, str) else salt
+        self.keep_text = keep_text
+
+    def pseudonym(self, value):
+        digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+        # Положительное число, как настоящие id пользователей Telegram
+        return int.from_bytes(digest[:6], "big") + 1
+
+    def __call__(self, value, key=None):
+        if isinstance(value, dict):
+            return {k: self(v, k) for k, v in value.items() if k not in _DROP_FIELDS}
+        if isinstance(value, list):
+            return [self(v) for v in value]
+        if key == "first_name":
+            return "Игрок"  # обязательное поле User в Bot API
+        if key in _ID_FIELDS and isinstance(value, int) and not isinstance(value, bool):
+            return self.pseudonym(value)
+        if key in ("text", "caption") and isinstance(value, str) and not self.keep_text:
+            return mask_text(value)
+        return value
+
+
+class TrafficRecorder:
+    def __init__(self, path, salt, keep_text=False):
+        self.path = path
+        self.anonymize = Anonymizer(salt, keep_text)
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, data):
+        # Вызывается из вебхука: только кладёт апдейт в очередь
+        try:
+            self._queue.put_nowait((time.time(), data))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5.0):
+        # Ждём, пока фоновый поток допишет всё, что уже в очереди
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                try:
+                    batch = [item]
+                    while len(batch) < 1000:
+                        try:
+                            batch.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    for arrived, data in batch:
+                        line = {"t": round(arrived, 3), "u": self.anonymize(data)}
+                        f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    f.flush()
+                    self.recorded += len(batch)
+                except Exception:
+                    logger.exception("Не удалось записать трафик")
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+
+def read_traffic(path):
+    # [(секунды от начала записи, апдейт), ...] в порядке прихода
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # недописанная последняя строка при аварийной остановке
+            records.append((record["t"], record["u"]))
+    records.sort(key=lambda record: record[0])
+    if not records:
+        return []
+    start = records[0][0]
+    return [(t - start, update) for t, update in records]
@@ -0,0 +1,49 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateWorkers:
+    # Фиксированный пул воркеров. Апдейты одного чата всегда попадают
+    # в одну и ту же очередь, поэтому порядок внутри чата сохраняется,
+    # а разные чаты обрабатываются параллельно.
+    def __init__(self, handler, workers=8, queue_size=1000):
+        self.handler = handler
+        per_worker = max(1, queue_size // workers)
+        self.queues = [queue.Queue(maxsize=per_worker) for _ in range(workers)]
+        self.threads = []
+        self.rejected = 0
+
+    def start(self):
+        for i, q in enumerate(self.queues):
+            t = threading.Thread(target=self._run, args=(q,), name=f"update-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, chat_id, item, done=None):
+        # done() вызывается после обработки item, даже если обработчик упал
+        q = self.queues[hash(chat_id) % len(self.queues)]
+        try:
+            q.put_nowait((item, done))
+        except queue.Full:
+            # Очередь переполнена — пусть Telegram повторит доставку позже
+            self.rejected += 1
+            return False
+        return True
+
+    def pending(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _run(self, q):
+        while True:
+            item, done = q.get()
+            try:
+                self.handler(item)
+            except Exception:
+                logger.exception("Ошибка при обработке апдейта")
+            finally:
+                if done is not None:
+                    done()
+                q.task_done()